@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# Benchmark harness for labwc-config/scripts/menu-generator.py
+#
+# Builds synthetic application and icon theme trees of configurable size, points the
+# generator at them through its LABWC_MENU_* root overrides and reports wall time,
+# syscalls (strace -c, when installed) and peak RSS for cold/warm cache x pipe/static
+# output runs. Results are written as JSON so runs can be compared.
+#
+# Examples:
+#   bench/menu-bench.py                                  # default matrix, JSON on stdout
+#   bench/menu-bench.py --apps 50,2000 --icons small,papirus --repeat 5 -o after.json
+#   bench/menu-bench.py --compare before.json after.json
+#
+# "cold" means an empty generator cache (~/.cache/labwc-menu); add --drop-caches (root
+# only) to also start every cold run with a cold page cache.
+
+import argparse, json, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_generator = os.path.join(repo_dir, "labwc-config", "scripts", "menu-generator.py")
+
+# themes: list of (icons per directory, sizes, contexts); the first theme is the selected one
+icon_presets = {
+	"small": [(150, ("16x16", "24x24", "32x32", "48x48"), ("apps", "categories", "actions", "places"))] * 4,
+	"medium": [(800, ("16x16", "22x22", "24x24", "32x32", "48x48", "scalable"), ("apps", "categories", "actions", "places", "devices", "mimetypes", "status", "emblems"))] * 3,
+	"papirus": [(1500, ("16x16", "22x22", "24x24", "32x32", "48x48", "64x64", "symbolic"), ("apps", "categories", "actions", "places", "devices", "mimetypes", "status", "emblems", "panel", "emotes"))]
+		+ [(150, ("16x16", "24x24", "32x32", "48x48"), ("apps", "categories", "actions", "places"))] * 3,
+}
+app_categories = ("AudioVideo;Audio;", "Development;IDE;", "Game;", "Graphics;", "Network;WebBrowser;", "Office;",
+	"Settings;", "System;", "Utility;", "Education;", "GTK;Utility;", "Qt;KDE;System;", "")
+footer_icons = ("utilities-terminal", "system-file-manager", "web-browser", "view-refresh", "preferences-system",
+	"preferences-desktop-theme", "text-editor", "system-lock-screen", "system-log-out", "system-shutdown",
+	"applications-multimedia", "applications-development", "applications-games", "applications-graphics",
+	"applications-internet", "applications-office", "preferences-desktop", "applications-system", "applications-utilities")
+
+class Fixture(object):
+	def __init__(self, root, apps, icons, seed=1):
+		self.root = root
+		self.apps = apps
+		self.icons = icons
+		self.home = root + "/home"
+		self.data = root + "/data"
+		self.flatpak = root + "/flatpak"
+		self.bin = root + "/bin"
+		self.cache = root + "/cache"
+		self.out = root + "/menu.xml"
+		self.app_dirs = [self.data + "/applications", self.home + "/.local/share/applications", self.flatpak + "/applications"]
+		self.icon_files = 0
+		self.rng = random.Random(seed)
+
+	def build(self):
+		for d in self.app_dirs + [self.bin, self.home + "/.config/gtk-3.0", self.data + "/pixmaps"]:
+			os.makedirs(d, exist_ok=True)
+		with open(self.home + "/.config/gtk-3.0/settings.ini", "w") as fh:
+			fh.write("[Settings]\ngtk-icon-theme-name=Bench0\n")
+		for i in range(200):
+			exe = "%s/exe%d" % (self.bin, i)
+			open(exe, "w").close()
+			os.chmod(exe, 0o755)
+		self.build_icons()
+		self.build_apps()
+		return self
+
+	def build_icons(self):
+		themes = icon_presets[self.icons]
+		for t, (count, sizes, contexts) in enumerate(themes):
+			name = "Bench%d" % t
+			root = "%s/icons/%s" % (self.data, name)
+			dirs = [s + "/" + c for s in sizes for c in contexts]
+			inherits = "Bench%d" % (t + 1) if t + 1 < len(themes) else "hicolor"
+			os.makedirs(root, exist_ok=True)
+			with open(root + "/index.theme", "w") as fh:
+				fh.write("[Icon Theme]\nName=%s\nInherits=%s\nDirectories=%s\n\n" % (name, inherits, ",".join(dirs)))
+				for d in dirs:
+					size = d.split("/")[0]
+					if size in ("scalable", "symbolic"):
+						fh.write("[%s]\nSize=16\nMinSize=8\nMaxSize=512\nType=Scalable\n\n" % d)
+					else:
+						fh.write("[%s]\nSize=%s\nType=Fixed\n\n" % (d, size.split("x")[0]))
+			for d in dirs:
+				os.makedirs(root + "/" + d)
+				ext = ".svg" if d.startswith(("scalable", "symbolic")) else ".png"
+				names = ["app%d" % i for i in range(t, count * 2, 2)][:count] # themes overlap partially
+				if t == 0:
+					names += list(footer_icons)
+				for n in names:
+					open(root + "/" + d + "/" + n + ext, "w").close()
+				self.icon_files += len(names)
+		os.makedirs(self.data + "/icons/hicolor/48x48/apps", exist_ok=True)
+		with open(self.data + "/icons/hicolor/index.theme", "w") as fh:
+			fh.write("[Icon Theme]\nName=Hicolor\nDirectories=48x48/apps\n\n[48x48/apps]\nSize=48\nType=Threshold\n")
+		for i in range(0, self.apps, 7):
+			open("%s/icons/hicolor/48x48/apps/hi%d.png" % (self.data, i), "w").close()
+			self.icon_files += 1
+
+	def build_apps(self):
+		for i in range(self.apps):
+			r = self.rng.random()
+			appDir = self.app_dirs[0] if r < 0.8 else self.app_dirs[1] if r < 0.9 else self.app_dirs[2]
+			exe = "exe%d" % self.rng.randrange(200) if self.rng.random() > 0.05 else "missing%d" % i
+			icon = self.rng.choice(("app%d" % i, "app%d" % i, "hi%d" % i, "/opt/app%d/icon.png" % i, "nosuchicon%d" % i))
+			with open("%s/bench-app%05d.desktop" % (appDir, i), "w") as fh:
+				fh.write("# synthetic entry\n[Desktop Entry]\nType=Application\nName=Bench app %d\nGenericName=Tool %d\n"
+					"Comment=Synthetic application number %d for benchmarking\nExec=%s %%U\nIcon=%s\nTerminal=%s\n"
+					"Categories=%s\nKeywords=bench;synthetic;%d;\n\n[Desktop Action New]\nName=New window\nExec=%s --new\n"
+					% (i, i, i, exe, icon, "true" if i % 9 == 0 else "false", self.rng.choice(app_categories), i, exe))
+
+	def env(self):
+		env = {
+			"HOME": self.home,
+			"PATH": self.bin, # keeps a real `labwc --reconfigure` out of static runs
+			"LANG": os.environ.get("LANG", "C.UTF-8"),
+			"LABWC_MENU_APPLICATIONS_DIRS": ":".join([self.app_dirs[1], self.app_dirs[0], self.app_dirs[2]]), # precedence order
+			"LABWC_MENU_DATA_DIRS": self.data + ":" + self.flatpak,
+			"LABWC_MENU_CACHE_DIR": self.cache,
+			"XDG_CACHE_HOME": self.home + "/.cache",
+			"XDG_DATA_HOME": self.home + "/.local/share",
+			"XDG_DATA_DIRS": self.data + ":" + self.flatpak,
+			"XDG_RUNTIME_DIR": self.root,
+		}
+		return env
+
+def drop_page_cache():
+	os.sync()
+	with open("/proc/sys/vm/drop_caches", "w") as fh:
+		fh.write("3\n")
+
+def strace_counts(path): # -> (total calls, {syscall: calls}) from an `strace -c` summary
+	counts = {}
+	with open(path) as fh:
+		for line in fh:
+			tokens = line.split()
+			if len(tokens) < 5 or tokens[-1] == "total" or not tokens[0][0].isdigit():
+				continue
+			try:
+				counts[tokens[-1]] = counts.get(tokens[-1], 0) + int(tokens[3])
+			except ValueError:
+				continue
+	return sum(counts.values()), counts
+
+def run_generator(generator, fx, mode, cold, strace=None, drop=False, extra=()):
+	if cold:
+		shutil.rmtree(fx.cache, ignore_errors=True)
+		if drop:
+			drop_page_cache()
+	cmd = [sys.executable, generator] + (["-o", fx.out] if mode == "static" else []) + list(extra)
+	if strace:
+		cmd = [strace, "-f", "-c", "-o", fx.root + "/strace.txt"] + cmd
+	start = time.perf_counter()
+	proc = subprocess.Popen(cmd, env=fx.env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	pid, status, usage = os.wait4(proc.pid, 0)
+	wall = time.perf_counter() - start
+	proc.returncode = os.waitstatus_to_exitcode(status)
+	if proc.returncode not in (0, 3): # 3: static menu was already up to date
+		raise RuntimeError("generator exited with %d: %s" % (proc.returncode, " ".join(cmd)))
+	return wall, usage.ru_maxrss
+
+def bench_fixture(generator, fx, repeat, strace, drop, extra):
+	results = []
+	for mode in ("pipe", "static"):
+		for cache in ("cold", "warm"):
+			cold = cache == "cold"
+			if not cold:
+				run_generator(generator, fx, mode, False, extra=extra) # populate
+			walls = []
+			rss = 0
+			for n in range(repeat):
+				wall, maxrss = run_generator(generator, fx, mode, cold, drop=drop, extra=extra)
+				walls.append(wall)
+				rss = max(rss, maxrss)
+			result = {
+				"apps": fx.apps,
+				"icons": fx.icons,
+				"icon_files": fx.icon_files,
+				"mode": mode,
+				"cache": cache,
+				"wall_s": {"min": min(walls), "median": statistics.median(walls), "max": max(walls)},
+				"peak_rss_kb": rss,
+				"syscalls": None,
+				"syscalls_top": None,
+			}
+			if strace:
+				run_generator(generator, fx, mode, cold, strace=strace, drop=drop, extra=extra)
+				total, counts = strace_counts(fx.root + "/strace.txt")
+				result["syscalls"] = total
+				result["syscalls_top"] = dict(sorted(counts.items(), key=lambda kv: -kv[1])[:8])
+			results.append(result)
+			print("%6d apps  %-8s %-6s %-4s  median %8.1f ms  rss %7d KiB  syscalls %s" % (fx.apps, fx.icons, mode, cache,
+				result["wall_s"]["median"] * 1000, rss, result["syscalls"]), file=sys.stderr)
+	return results
+
+def result_key(r):
+	return (r["apps"], r["icons"], r["mode"], r["cache"])
+
+def compare(before_file, after_file):
+	with open(before_file) as fh:
+		before = {result_key(r): r for r in json.load(fh)["results"]}
+	with open(after_file) as fh:
+		after = json.load(fh)["results"]
+	print("%6s %-8s %-6s %-4s %10s %10s %7s %9s" % ("apps", "icons", "mode", "cache", "before ms", "after ms", "ratio", "rss diff"))
+	for r in after:
+		b = before.get(result_key(r))
+		if b is None:
+			continue
+		bw = b["wall_s"]["median"] * 1000
+		aw = r["wall_s"]["median"] * 1000
+		print("%6d %-8s %-6s %-4s %10.1f %10.1f %6.2fx %+8d" % (r["apps"], r["icons"], r["mode"], r["cache"], bw, aw,
+			bw / aw if aw else 0, r["peak_rss_kb"] - b["peak_rss_kb"]))
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark menu-generator.py against synthetic application/icon trees.")
+	parser.add_argument("--apps", default="50,500,5000", help="Comma separated .desktop file counts (50 - 20000). Default: %(default)s")
+	parser.add_argument("--icons", default="small,papirus", help="Comma separated icon tree presets: %s. Default: %%(default)s" % ", ".join(icon_presets))
+	parser.add_argument("--repeat", type=int, default=3, help="Timed runs per mode. Default: %(default)s")
+	parser.add_argument("--generator", default=default_generator, help="Generator to benchmark. Default: this checkout")
+	parser.add_argument("--workdir", help="Build fixtures here and keep them (default: a removed temp dir)")
+	parser.add_argument("--no-strace", action="store_true", help="Skip syscall counting even if strace is installed")
+	parser.add_argument("--drop-caches", action="store_true", help="Drop the page cache before cold runs (needs root)")
+	parser.add_argument("--extra", default="", help="Extra arguments passed to the generator, e.g. \"--no-icons\"")
+	parser.add_argument("-o", "--output", help="Write JSON results here instead of stdout")
+	parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files and exit")
+	args = parser.parse_args()
+
+	if args.compare:
+		compare(*args.compare)
+		return
+	strace = None if args.no_strace else shutil.which("strace")
+	if strace is None and not args.no_strace:
+		print("strace not found, syscall counts will be null", file=sys.stderr)
+	workdir = args.workdir or tempfile.mkdtemp(prefix="menu-bench-")
+	results = []
+	try:
+		for icons in args.icons.split(","):
+			if icons not in icon_presets:
+				parser.error("unknown icon preset %r" % icons)
+			for apps in [int(n) for n in args.apps.split(",")]:
+				root = os.path.join(workdir, "%s-%d" % (icons, apps))
+				if os.path.isdir(root + "/data"): # reuse a fixture kept with --workdir
+					fx = Fixture(root, apps, icons)
+					fx.icon_files = sum(len(files) for d, sub, files in os.walk(fx.data + "/icons"))
+				else:
+					print("building %d apps / %s icons in %s" % (apps, icons, root), file=sys.stderr)
+					fx = Fixture(root, apps, icons).build()
+				results += bench_fixture(args.generator, fx, args.repeat, strace, args.drop_caches, args.extra.split())
+	finally:
+		if not args.workdir:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+	report = {
+		"generator": os.path.abspath(args.generator),
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"cpus": os.cpu_count(),
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"repeat": args.repeat,
+		"results": results,
+	}
+	if args.output:
+		with open(args.output, "w") as fh:
+			json.dump(report, fh, indent=1)
+	else:
+		json.dump(report, sys.stdout, indent=1)
+		print()
+
+if __name__ == "__main__":
+	main()
@@ -141,6 +141,8 @@ mkdir -p "$CONFIG_DIR/labwc" || { print_error "Failed to create labwc config dir
 cp "$SCRIPT_DIR/labwc-config/autostart" "$CONFIG_DIR/labwc/"
 cp "$SCRIPT_DIR/labwc-config/environment" "$CONFIG_DIR/labwc/"
 cp "$SCRIPT_DIR/labwc-config/labwc.xml" "$CONFIG_DIR/labwc/"
+cp "$SCRIPT_DIR/labwc-config/menu-ignore.conf" "$CONFIG_DIR/labwc/"
+cp "$SCRIPT_DIR/labwc-config/menu-categories.conf" "$CONFIG_DIR/labwc/"
 # Remove rc.xml so it cannot override theme (labwc.xml is the single source)
 rm -f "$CONFIG_DIR/labwc/rc.xml"
 
@@ -239,7 +241,9 @@ mkdir -p "$CONFIG_DIR/systemd/user"
 cp "$CONFIG_DIR/labwc/systemd/"*.service "$CONFIG_DIR/systemd/user/"
 cp "$CONFIG_DIR/labwc/systemd/"*.timer "$CONFIG_DIR/systemd/user/"
 systemctl --user daemon-reload || print_warning "Failed to reload systemd daemon"
-systemctl --user enable --now labwc-menu-update.timer || print_warning "Failed to enable menu-update timer"
+# Menu is regenerated on inotify events by the watch service; the periodic timer is only a fallback
+systemctl --user disable --now labwc-menu-update.timer 2>/dev/null || true
+systemctl --user enable --now labwc-menu-watch.service || print_warning "Failed to enable menu-watch service"
 systemctl --user enable labwc-gtk-sync.service || print_warning "Failed to enable gtk-sync service"
 systemctl --user enable labwc-portal-restart.service || print_warning "Failed to enable portal-restart service"
 systemctl --user enable labwc-theme-watcher.service || print_warning "Failed to enable theme-watcher service"
@@ -336,7 +340,7 @@ print_status "What's been installed:"
 echo "  - Labwc window manager configuration"
 echo "  - LXQt desktop environment configuration"
 echo "  - Vermello theme (Openbox-style) - existing customizations preserved"
-echo "  - Dynamic menu generation with systemd timer"
+echo "  - Dynamic menu generation (regenerated when apps are installed)"
 echo "  - GTK/Portal sync services"
 echo ""
 print_status "Backup location: $BACKUP_DIR"
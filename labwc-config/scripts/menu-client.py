@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+#
+# Tiny pipe menu client for `menu-generator.py --daemon`.
+# Prints the menu the daemon keeps ready on its Unix socket, so opening the menu
+# only pays for interpreter startup. Without a running daemon it falls back to
+# running menu-generator.py directly (arguments are passed through).
+#
+# Use it as a labwc pipe menu, e.g. in menu.xml:
+#   <menu id="apps-menu" label="Applications" execute="~/.config/labwc/scripts/menu-client.py" />
+
+import os, socket, sys
+
+runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "labwc-menu")
+sock_path = os.path.join(runtime_dir, "labwc-menu.sock")
+
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+sock.settimeout(10)
+try:
+	sock.connect(sock_path)
+except OSError: # no daemon
+	generator = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu-generator.py")
+	os.execv(sys.executable, [sys.executable, generator] + sys.argv[1:])
+
+out = sys.stdout.buffer
+try:
+	while True:
+		chunk = sock.recv(65536)
+		if not chunk:
+			break
+		out.write(chunk)
+except OSError as e:
+	print(f"Error reading from menu daemon: {e}", file=sys.stderr)
+	sys.exit(1)
+out.flush()
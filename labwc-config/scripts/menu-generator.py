@@ -18,157 +18,1009 @@
 # - ADDED: Static file generation with pretty printing for Labwc
 # - ADDED: Custom Footer with dynamic icons and separator
 # - ADDED: Auto-reconfigure Labwc after static generation
+# - ADDED: Persistent icon index in ~/.cache/labwc-menu, rebuilt per theme only when its directories change
+# - ADDED: Exact-name icon lookup per freedesktop spec (index.theme, Inherits, hicolor, pixmaps)
+# - ADDED: Per-file .desktop parse cache keyed by path, mtime and size
+# - ADDED: --watch mode regenerating the static menu on inotify events
+# - ADDED: Cached PATH executable index for Exec/TryExec checks instead of which()
+# - ADDED: Parallel desktop file parsing (--jobs)
+# - ADDED: Resident pipe menu daemon (--daemon) served over a Unix socket to menu-client.py
+# - ADDED: LABWC_MENU_APPLICATIONS_DIRS / LABWC_MENU_DATA_DIRS / LABWC_MENU_CACHE_DIR root overrides
+# - ADDED: --stats / LABWC_MENU_STATS per-phase timings and counters (stderr, JSON or journal)
+# - ADDED: Import-safe MenuBuilder(MenuConfig(...)).build() API; theme and icon state load on first use
+# - ADDED: -o renders in memory and replaces menu.xml atomically; unchanged content skips write and reconfigure (exit 3)
+# - ADDED: One emitter for static and pipe output (MenuFormat layouts), single linear escape instead of CDATA/double escaping
+# - ADDED: $XDG_DATA_HOME/$XDG_DATA_DIRS discovery with desktop-file IDs; only the highest precedence file per ID is read
+# - ADDED: menu-ignore.conf (exact ID / glob / regex rules compiled into one matcher), NoDisplay/Hidden/OnlyShowIn/NotShowIn
+# - ADDED: Icon lookup straight from mmapped GTK icon-theme.cache files when they are fresh
+# - ADDED: --target: several outputs (static/pipe XML with or without icons and footer, JSON app model) from one scan
+# - ADDED: Compact theme indexes (directory table, sorted names, index arrays) and __slots__ entries with precomputed sort keys
+# - ADDED: --index search index (word prefixes + trigrams over Name/GenericName/Keywords/Comment) and ranked --query
+# - ADDED: --render-icons: icons pre-rendered to menu size (--icon-scale for HiDPI) as PNGs in the cache, stale renders evicted
+# - ADDED: --lazy root pipe menu whose categories are nested --category pipe menus read from a cached per-category model
+# - ADDED: --check: exit 3 right away when no input mtime (app dirs, icon roots, GTK settings, PATH, outputs) changed since the last run
+# - ADDED: flock()ed generations: requests during a run coalesce into one rerun and waiters get its exit status
+# - ADDED: Theme directories listed in parallel with os.scandir; themes without index.theme are walked instead of guessed
+# - ADDED: Application sources (XDG, flatpak, snap, AppImage, ~/.local/bin) listed concurrently, each with its own cache
+# - ADDED: Category table compiled once from the settings below and menu-categories.conf (groups, ranks, icons per theme)
+#
+# Library use (the file name has a dash, so load it by path):
+#   spec = importlib.util.spec_from_file_location("menu_generator", ".../menu-generator.py")
+#   mg = importlib.util.module_from_spec(spec); spec.loader.exec_module(mg)
+#   menu = mg.MenuBuilder(mg.MenuConfig(showFooter=False)).build()
+# Importing does no I/O; the scan happens in build().
 #
 # ----- config ---
 
-import subprocess, glob, os, sys, argparse
+import os, sys, time, threading, contextlib
+from array import array
+from bisect import bisect_left
+# pickle, subprocess, glob, json, select, struct, socket, signal and concurrent.futures are imported
+# where they are used, so importing this module (or running --help) stays cheap
+
+# --- Run statistics (--stats / LABWC_MENU_STATS) ---
+class Stats(object):
+	# Top-level phases are consecutive laps since the previous lap; "nested" timers are summed
+	# across worker threads and overlap the phase they run in (e.g. icon-lookup inside parse).
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.started = self.last = time.perf_counter()
+		self.phases = {}
+		self.nested = {}
+		self.counters = {}
+
+	def lap(self, name):
+		now = time.perf_counter()
+		self.phases[name] = self.phases.get(name, 0.0) + now - self.last
+		self.last = now
+
+	@contextlib.contextmanager
+	def timer(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			with self.lock:
+				self.nested[name] = self.nested.get(name, 0.0) + elapsed
+
+	def count(self, name, n=1):
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def summary(self):
+		return {
+			"total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+			"phases_ms": {k: round(v * 1000, 3) for k, v in self.phases.items()},
+			"nested_ms": {k: round(v * 1000, 3) for k, v in self.nested.items()},
+			"counters": dict(sorted(self.counters.items())),
+		}
+
+	def report(self, modes): # modes: any of text, json, journal
+		data = self.summary()
+		if "json" in modes:
+			import json
+			print(json.dumps(data), file=sys.stderr)
+		if "text" in modes:
+			print("menu-generator: %.1f ms total" % data["total_ms"], file=sys.stderr)
+			for k, v in data["phases_ms"].items():
+				print("  %-16s %9.1f ms" % (k, v), file=sys.stderr)
+			for k, v in data["nested_ms"].items():
+				print("  (%-14s %9.1f ms)" % (k, v), file=sys.stderr)
+			for k, v in data["counters"].items():
+				print("  %-16s %9d" % (k, v), file=sys.stderr)
+		if "journal" in modes:
+			import subprocess
+			c = data["counters"]
+			line = "menu generated in %.0f ms: %d parsed, %d cached, %d ignored, %d without exec, icons %d hit/%d miss, %d listdir, %d stat" % (
+				data["total_ms"], c.get("files_parsed", 0), c.get("files_cached", 0), c.get("files_ignored", 0), c.get("rejected_no_exec", 0),
+				c.get("icon_hits", 0), c.get("icon_misses", 0), c.get("listdir", 0), c.get("stat", 0))
+			try:
+				subprocess.run(["logger", "-t", "labwc-menu", line], check=False)
+			except FileNotFoundError:
+				print(line, file=sys.stderr)
+
+stats = Stats()
+stats_modes = os.environ.get("LABWC_MENU_STATS", "") # e.g. "journal" in the systemd units; --stats overrides
 
 userhome = os.path.expanduser('~')
-applications_dirs = ("/usr/share/applications", userhome + "/.local/share/applications","/var/lib/flatpak/exports/share/applications")
-image_dir_base = ("/usr/share", "/var/lib/flatpak/exports/share") # without "pixmaps" -/usr/local/share in FreeBSD, /usr/share on linux
+# desktop entries are looked up like the XDG menu spec does: $XDG_DATA_HOME first, then $XDG_DATA_DIRS,
+# highest precedence first - a file in an earlier dir hides every file with the same desktop-file ID after it
+data_home = os.environ.get("XDG_DATA_HOME") or userhome + "/.local/share"
+data_dirs = [d for d in (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(":") if d]
+applications_dirs = tuple(dict.fromkeys([data_home + "/applications"] + [d + "/applications" for d in data_dirs]))
+image_dir_base = ("/usr/share", "/var/lib/flatpak/exports/share") # without "pixmaps" -/usr/local/share in FreeBSD, /usr/share on linux; searched after the application sources' data dirs (see MenuConfig)
+cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or userhome + "/.cache", "labwc-menu")
+# roots can be overridden from the environment (colon separated, applications dirs highest precedence first),
+# e.g. to point bench/menu-bench.py at synthetic trees
+if os.environ.get("LABWC_MENU_APPLICATIONS_DIRS"):
+	applications_dirs = tuple(os.environ["LABWC_MENU_APPLICATIONS_DIRS"].split(":"))
+if os.environ.get("LABWC_MENU_DATA_DIRS"):
+	image_dir_base = tuple(os.environ["LABWC_MENU_DATA_DIRS"].split(":"))
+if os.environ.get("LABWC_MENU_CACHE_DIR"):
+	cache_dir = os.environ["LABWC_MENU_CACHE_DIR"]
+# Application sources, highest precedence first: name -> (kind, roots), see AppSource. A desktop-file ID
+# found in an earlier source hides the same ID in later ones, and a directory an earlier source already
+# walks is left out of the later ones (flatpak and snap exports are often in $XDG_DATA_DIRS as well).
+# "local-bin" puts every executable in ~/.local/bin into the menu, so it is not enabled by default:
+# pip and friends install their command line tools there too.
+source_roots = {
+	"xdg": ("desktop", applications_dirs),
+	"flatpak-user": ("desktop", (data_home + "/flatpak/exports/share/applications",)),
+	"flatpak": ("desktop", ("/var/lib/flatpak/exports/share/applications",)),
+	"snap": ("desktop", ("/var/lib/snapd/desktop/applications",)),
+	"appimage": ("appimage", (userhome + "/Applications", userhome + "/AppImages", userhome + "/.local/bin")),
+	"local-bin": ("local-bin", (userhome + "/.local/bin",)),
+}
+application_sources = ("xdg", "flatpak-user", "flatpak", "snap", "appimage")
+if os.environ.get("LABWC_MENU_APPLICATIONS_DIRS"): # overridden applications dirs are the only source
+	application_sources = ("xdg",)
+
+# Menu groups, see CategoryTable. menu-categories.conf (the first of category_files that exists) adds
+# groups, category mappings, ranks and icons on top of these, so new groups need no edit here.
+application_groups = ("AudioVideo", "Development", "Editors",  "Engineering", "Games", "Graphics", "Internet",  "Multimedia", "Office",  "Other",  "Settings", "System",  "Utilities") # enter here new category as you wish, it will be sorted
+group_aliases = {"Audio":"Multimedia","Video":"Multimedia","AudioVideo":"Multimedia","Network":"Internet","Game":"Games", "Utility":"Utilities", "Development":"Editors","GTK":"",  "GNOME":""}
+# an app with categories in several groups is filed under the lowest ranked one; unranked groups come last
+group_ranks = {"Games": 10, "Multimedia": 20, "Graphics": 30, "Office": 40, "Internet": 50, "Editors": 60, "System": 70, "Settings": 80, "Utilities": 90, "Other": 100}
+# submenu icon names ("applications-" + lower-cased group unless listed) and the exceptions per icon theme
+category_icons = {"Editors": "applications-development", "Settings": "preferences-desktop"}
+theme_category_icons = {
+	"breeze": {"Editors": "applications-education-language", "Settings": "applications-development"},
+	"breeze-dark": {"Editors": "applications-education-language", "Settings": "applications-development"},
+	"Adwaita": {"Editors": "accessories-text-editor", "Multimedia": "audio-speakers", "Education": "accessories-dictionary"},
+	"gnome": {"Editors": "accessories-text-editor", "Education": "accessories-dictionary"},
+	"Papirus": {"Education": "accessories-dictionary"},
+	"Tango": {"Utilities": "applications-accessories"},
+}
+category_files = (
+	os.path.join(os.environ.get("XDG_CONFIG_HOME") or userhome + "/.config", "labwc", "menu-categories.conf"),
+	os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "menu-categories.conf")),
+)
+
+# Entries to leave out of the menu are listed in menu-ignore.conf (exact desktop-file IDs, globs and
+# regexes, see that file). The first of these that exists is used; the second is the copy shipped
+# next to the scripts directory, so a fresh checkout behaves like an installed one.
+ignore_files = (
+	os.path.join(os.environ.get("XDG_CONFIG_HOME") or userhome + "/.config", "labwc", "menu-ignore.conf"),
+	os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "menu-ignore.conf")),
+)
+# desktops OnlyShowIn/NotShowIn are matched against besides $XDG_CURRENT_DESKTOP (labwc:wlroots here),
+# unless menu-ignore.conf has desktops: rules; LXQt so its settings tools stay in the menu
+show_in_desktops = ("LXQt",)
+
+terminal_string = "alacritty"
+
+#constants for icon lookup
+image_file_prefix = (".png", ".svg", ".xpm") # also the lookup preference inside one directory
+icon_size = 48 # size the theme directories are ranked against (freedesktop DirectorySizeDistance)
+menu_icon_size = 24 # px labwc draws a menu icon at (about one menu item high), for --render-icons
+
+# --- Custom footer ---
+# Quick launch items at top level
+footer_quick_items = [
+	{
+		"label": "Terminal", 
+		"action": "Execute", 
+		"cmd": "alacritty", 
+		"icons": ["utilities-terminal", "terminal", "org.gnome.Terminal"]
+	},
+	{
+		"label": "File Manager", 
+		"action": "Execute", 
+		"cmd": "pcmanfm-qt", 
+		"icons": ["system-file-manager", "folder", "org.gnome.Files"]
+	},
+	{
+		"label": "Web Browser", 
+		"action": "Execute", 
+		"cmd": "firefox", 
+		"icons": ["firefox", "web-browser", "internet-web-browser"]
+	},
+]
+
+# Config submenu items
+footer_config_items = [
+	{
+		"label": "Reconfigure Labwc", 
+		"action": "Reconfigure", 
+		"cmd": None, 
+		"icons": ["view-refresh", "reload", "preferences-system"]
+	},
+	{
+		"label": "Update Menu", 
+		"action": "Execute", 
+		"cmd": "~/.config/labwc/scripts/menu-update.sh", 
+		"icons": ["view-refresh", "reload", "system-software-update"]
+	},
+	{"separator": True},
+	{
+		"label": "Sync GTK Theme", 
+		"action": "Execute", 
+		"cmd": "~/.config/labwc/scripts/gtk.sh", 
+		"icons": ["preferences-desktop-theme", "preferences-desktop", "gtk-preferences"]
+	},
+	{
+		"label": "Restart Portals", 
+		"action": "Execute", 
+		"cmd": "systemctl --user restart xdg-desktop-portal", 
+		"icons": ["view-refresh", "preferences-system", "system-run"]
+	},
+	{"separator": True},
+	{
+		"label": "Edit Labwc Config", 
+		"action": "Execute", 
+		"cmd": "xdg-open ~/.config/labwc/labwc.xml", 
+		"icons": ["text-editor", "accessories-text-editor", "gedit"]
+	},
+	{
+		"label": "Edit Theme", 
+		"action": "Execute", 
+		"cmd": "xdg-open ~/.local/share/themes/NIGHT-RED/openbox-3/themerc", 
+		"icons": ["preferences-desktop-theme", "preferences-desktop", "applications-graphics"]
+	},
+]
+
+# Session submenu items (Openbox-style)
+footer_session_items = [
+	{
+		"label": "Lock Screen", 
+		"action": "Execute", 
+		"cmd": "loginctl lock-session", 
+		"icons": ["system-lock-screen", "lock", "preferences-desktop-screensaver"]
+	},
+	{
+		"label": "Suspend", 
+		"action": "Execute", 
+		"cmd": "systemctl suspend", 
+		"icons": ["system-suspend", "sleep", "gnome-session-suspend"]
+	},
+	{
+		"label": "Hibernate", 
+		"action": "Execute", 
+		"cmd": "systemctl hibernate", 
+		"icons": ["system-hibernate", "gnome-session-hibernate"]
+	},
+	{"separator": True},
+	{
+		"label": "Log Out", 
+		"action": "Exit", 
+		"cmd": None, 
+		"icons": ["system-log-out", "gnome-logout", "exit"]
+	},
+	{
+		"label": "Reboot", 
+		"action": "Execute", 
+		"cmd": "systemctl reboot", 
+		"icons": ["system-reboot", "view-refresh", "gnome-session-reboot"]
+	},
+	{
+		"label": "Shutdown", 
+		"action": "Execute", 
+		"cmd": "systemctl poweroff", 
+		"icons": ["system-shutdown", "gnome-shutdown", "power-off"]
+	},
+]
+
+# Footer layout: separator, quick launch items, separator, then the submenus
+footer_submenus = (
+	("config-menu", "Config", ["preferences-system", "preferences-desktop", "applications-system"], footer_config_items),
+	("session-menu", "Session", ["system-log-out", "gnome-logout", "preferences-system"], footer_session_items), # power/logout options
+)
+
+class MenuConfig(object):
+	# Everything a MenuBuilder needs; anything left out falls back to the module settings above.
+	def __init__(self, appDirs=None, dataDirs=None, cacheDir=None, iconTheme=None, showIcons=True, showFooter=True, jobs=None, home=None, ignoreFile=None, desktops=None, renderSize=0, sources=None, categoryFile=None):
+		self.home = home or userhome
+		self.applications_dirs = tuple(appDirs or applications_dirs)
+		self.sources = tuple(sources or (("xdg",) if appDirs else application_sources)) # names in source_roots
+		self.source_roots = dict(source_roots, xdg=("desktop", self.applications_dirs))
+		self.image_dir_base = tuple(dataDirs or image_dir_base)
+		self.cache_dir = cacheDir or cache_dir
+		self.icon_theme = iconTheme # None: read it from the GTK settings on first use
+		self.show_icons = showIcons
+		self.show_footer = showFooter
+		self.jobs = jobs if jobs is not None else default_jobs()
+		self.ignore_files = (ignoreFile,) if ignoreFile else ignore_files
+		self.category_files = (categoryFile,) if categoryFile else category_files
+		self.desktops = tuple(desktops if desktops is not None else [d for d in os.environ.get("XDG_CURRENT_DESKTOP", "").split(":") if d]) # for OnlyShowIn/NotShowIn, plus MenuBuilder.desktops
+		# icons are looked up below the data dirs the applications come from (<dir>/applications -> <dir>/icons,
+		# <dir>/pixmaps: $XDG_DATA_DIRS, flatpak and snap exports), in source order, then below image_dir_base
+		bases = [os.path.dirname(root) for name in self.sources if self.source_roots.get(name, ("",))[0] == "desktop" for root in self.source_roots[name][1] if root.endswith("/applications")]
+		bases = list(dict.fromkeys(bases + list(self.image_dir_base)))
+		self.icon_dirs = list(dict.fromkeys([self.home + "/.icons", self.home + "/.local/share/icons"] + [b + "/icons" for b in bases])) # spec base directory order
+		self.pixmap_dirs = [b + "/pixmaps" for b in bases if os.path.isdir(b + "/pixmaps")] # probed per missing icon, so only the ones that exist
+		self.render_size = renderSize # px of pre-rendered menu icons, 0 = point the menu at the theme files
+
+def default_jobs():
+	return min(8, os.cpu_count() or 1)
 
 # --- Theme Selection Logic ---
-selected_theme = None
-
-# Priority: Check GTK 3.0 settings
-try:
-	gtk3_config = userhome + "/.config/gtk-3.0/settings.ini"
-	if os.path.exists(gtk3_config):
-		with open(gtk3_config, 'r') as f:
-			for line in f:
-				if "gtk-icon-theme-name" in line and "=" in line:
-					selected_theme = line.split("=", 1)[1].strip().strip('"').strip("'")
-					break
-except IOError:
-	pass
+def gtk_settings_files(home=userhome): # what detect_icon_theme reads, in order
+	return (home + "/.config/gtk-3.0/settings.ini", home + "/.gtkrc-2.0")
+
+def detect_icon_theme(home=userhome):
+	gtk3_config, gtk2_config = gtk_settings_files(home)
+	# Priority: Check GTK 3.0 settings
+	try:
+		if os.path.exists(gtk3_config):
+			with open(gtk3_config, 'r') as f:
+				for line in f:
+					if "gtk-icon-theme-name" in line and "=" in line:
+						return line.split("=", 1)[1].strip().strip('"').strip("'")
+	except IOError:
+		pass
 
-# Fallback: Check GTK 2.0 config
-if selected_theme is None:
+	# Fallback: Check GTK 2.0 config
 	try:
-		with open(userhome + "/.gtkrc-2.0", 'r') as readobj:
+		with open(gtk2_config, 'r') as readobj:
 			for line in readobj:
 				if "gtk-icon-theme-name" in line:
 					parts = line.split("\"")
 					if len(parts) > 1:
-						selected_theme = parts[1]
-						break
+						return parts[1]
 	except IOError:
 		pass
 
-# Final Fallback
-if selected_theme is None:
-	selected_theme = "Adwaita"
+	# Final Fallback
+	return "Adwaita"
 
-application_groups = ("AudioVideo", "Development", "Editors",  "Engineering", "Games", "Graphics", "Internet",  "Multimedia", "Office",  "Other",  "Settings", "System",  "Utilities") # enter here new category as you wish, it will be sorted
-group_aliases = {"Audio":"Multimedia","Video":"Multimedia","AudioVideo":"Multimedia","Network":"Internet","Game":"Games", "Utility":"Utilities", "Development":"Editors","GTK":"",  "GNOME":""}
+def installed_icon_theme(theme, icon_dirs): # tolerate "Papirus" for "Papirus-Dark" style settings
+	if any(os.path.exists(d + "/" + theme) for d in icon_dirs):
+		return theme
+	iconThemes = sorted(set(t for d in icon_dirs if os.path.isdir(d) for t in os.listdir(d)), key=str.lower)
+	tmplst = [s for s in iconThemes if theme in s]
+	return tmplst[0] if tmplst else "hicolor"
 
-# Expanded ignore list - remove duplicates, X11-only apps, internal tools, URL handlers
-# NOTE: These are matched against the .desktop filename path
-ignoreList = (
-    # Internal/demo tools
-    "gtk3-icon-browser", "gtk3-demo", "gtk3-widget-factory", "evince-previewer", "yad-icon-browser",
-    # URL handlers (duplicates of main apps)
-    "windsurf-url-handler", "code-url-handler",
-    # X11-only tools (not useful in Wayland/Labwc)
-    "arandr.desktop", "obconf.desktop", "xfce4-panel", "xfce4-im-chooser", "xscreensaver-settings", 
-    "lxsession-default-apps", "lxsession-edit",
-    # Background services (not user-facing)
-    "xwaylandvideobridge", "org.freedesktop.Xwayland", "pinentry", "picom", "compton",
-    # KDE internal tools
-    "knewstuff-dialog", "keditbookmarks", "kinfocenter", "org.kde.systemsettings",
-    # Session/power items (handled by our Session submenu)
-    "lxqt-leave.desktop",
-    # Duplicate settings apps  
-    "lxappearance.desktop", "systemsettings.desktop",
-    # Wayfire (not using this compositor)
-    "wcm.desktop", "wayfire",
-    # Misc junk/niche tools
-    "Ted", "wingide3.2", "python3.4", "feh", "xfce4-power-manager-settings", 
-    "org.gnome.Tecla", "gnome-abrt", "sealert",
-    "gkbd-keyboard-display",  # keyboard layout viewer
-    # IBus input methods (niche)
-    "ibus-setup", "org.freedesktop.IBus", "im-chooser",
-    # Terminals (we have quick launch)
-    "xterm.desktop", "qterminal.desktop", "qterminal-drop.desktop", "Alacritty.desktop",
-    # More session items
-    "lxqt-hibernate", "lxqt-lockscreen", "lxqt-logout", "lxqt-reboot", "lxqt-shutdown", "lxqt-suspend",
-    # Java dev tools (not general use)
-    "jconsole", "openjdk",
-    # Desktop prefs (not useful without desktop icons)
-    "pcmanfm-qt-desktop-pref",
-)
+def readIndexTheme(path): # minimal ini reader for index.theme -> {section: {key: value}}
+	sections = {}
+	cur = None
+	with open(path, "r", errors="replace") as fh:
+		for line in fh:
+			line = line.strip()
+			if not line or line[0] == "#":
+				continue 
+			if line[0] == "[" and line[-1] == "]":
+				cur = sections.setdefault(line[1:-1], {})
+			elif cur is not None and "=" in line:
+				k, v = line.split("=", 1)
+				cur[k.strip()] = v.strip()
+	return sections
 
-prefixes = ("legacy","categories","apps","devices","mimetypes","places","preferences","actions", "status","emblems") #added for prefered icon dirs and sizes. could be gathered automatically but wouldn't be sorted like this
-iconSizes = ("48","32","24","16","48x48","40x40","36x36","32x32","24x24","64x64","72x72","96x96","16x16","128x128","256x256","scalable","apps","symbolic")
-terminal_string = "alacritty"
-  
-#constants and list for icon list generating
-image_file_prefix = (".png", ".svg", ".xpm")
-image_cat_prefix = ("applications-", "accessories-dictionary", "accessories-text-editor","preferences-desktop.","audio-speakers") 
-iconThemes=os.listdir(image_dir_base[0]+"/icons")
-tmplst=[s for s in iconThemes if selected_theme in s]
-selected_theme = iconThemes[0] if tmplst == [] else tmplst[0]
-iconThemes.sort(key=str.lower)
-
-if selected_theme in iconThemes:
-	iconThemes.remove(selected_theme)
-iconThemes.remove('hicolor') if 'hicolor' in iconThemes else False
-iconThemes.insert(0, selected_theme) if selected_theme != 'hicolor' else False
-iconThemes.insert(0, "hicolor")
-iconList=[]
-
-#getting icons to lists for faster menu generate
-def addIconsToList(List, theme): # skip to next icon theme if any icon couldn't found on current
-	for path in reversed(image_dir_base):
-		for prfx in prefixes:
-			for size in iconSizes:
-				tmp = path + "/icons/" + theme + "/" + size + "/" + prfx
-				if theme == "breeze" or theme == "breeze-dark":
-					tmp = path + "/icons/" + theme + "/" + prfx + "/" + size
+def sizeDistance(d): # freedesktop DirectorySizeDistance for icon_size at scale 1
+	try:
+		size = int(d.get("Size", "0"))
+		scale = int(d.get("Scale", "1"))
+		dtype = d.get("Type", "Threshold")
+		if dtype == "Fixed":
+			return abs(size * scale - icon_size)
+		minsize = int(d.get("MinSize", size)) * scale
+		maxsize = int(d.get("MaxSize", size)) * scale
+		if dtype == "Threshold":
+			threshold = int(d.get("Threshold", "2"))
+			if icon_size < (size - threshold) * scale:
+				return minsize - icon_size
+			if icon_size > (size + threshold) * scale:
+				return icon_size - maxsize
+			return 0
+		if icon_size < minsize:
+			return minsize - icon_size
+		if icon_size > maxsize:
+			return icon_size - maxsize
+		return 0
+	except ValueError:
+		return 9999
+
+def rankDirectories(subdirs, sections): # subdirectories ordered best match first
+	typeOrder = {"Fixed": 0, "Threshold": 1, "Scalable": 2}
+	def rank(item):
+		pos, sub = item
+		d = sections.get(sub, {})
+		return (sizeDistance(d), d.get("Scale", "1") != "1", typeOrder.get(d.get("Type", "Threshold"), 1), pos)
+	return [sub for pos, sub in sorted(enumerate(dict.fromkeys(subdirs)), key=rank)]
+
+def themeDirectories(sections): # the ranked Directories/ScaledDirectories of an index.theme, None when it lists none
+	meta = sections.get("Icon Theme", {})
+	subdirs = [s.strip() for s in (meta.get("Directories", "") + "," + meta.get("ScaledDirectories", "")).split(",") if s.strip()]
+	return rankDirectories(subdirs, sections) if subdirs else None
+
+def guessedDirectory(sub): # index.theme style entry read off a path such as "48x48/apps", "apps/32@2x" or "scalable/places"
+	d = {"Size": "0", "Type": "Fixed"} # no size in the name: ranked after every sized directory
+	for part in sub.split("/"):
+		size, at, scale = part.partition("@")
+		size = size.split("x", 1)[0]
+		if size.isdigit():
+			d = {"Size": size, "Type": "Fixed", "Scale": scale.rstrip("x") or "1"}
+		elif part == "scalable":
+			d = {"Size": str(icon_size), "Type": "Scalable", "MinSize": "1", "MaxSize": "512"}
+	return d
+
+def walkThemeRoot(root, depth=3): # every directory below a theme root, as paths relative to it
+	found = []
+	def walk(rel, left):
+		stats.count("listdir")
+		try:
+			with os.scandir(root + "/" + rel if rel else root) as it:
+				subs = sorted(e.name for e in it if e.is_dir())
+		except OSError:
+			return
+		for name in subs:
+			sub = rel + "/" + name if rel else name
+			found.append(sub)
+			if left > 1: # context/size/scale is as deep as themes go; also stops symlink loops
+				walk(sub, left - 1)
+	walk("", depth)
+	return found
+
+def listIconDir(path): # -> (names, mtime) of one theme directory, None if it does not exist; runs on the scan pool
+	stats.count("listdir")
+	try:
+		with os.scandir(path) as it:
+			names = [e.name for e in it]
+	except OSError:
+		return None
+	return names, mtimeOf(path)
+
+def mtimeOf(path):
+	stats.count("stat")
+	try:
+		return os.stat(path).st_mtime_ns
+	except OSError:
+		return 0
+
+def stampIsCurrent(stamp):
+	for path, mtime in stamp.items():
+		if mtimeOf(path) != mtime:
+			return False
+	return True
+
+def writeCache(path, data, what): # atomic pickle write, a failure only costs the next run a rescan
+	import pickle
+	return writeCacheBytes(path, pickle.dumps(data, pickle.HIGHEST_PROTOCOL), what)
+
+def writeCacheBytes(path, blob, what):
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = path + ".%d.tmp" % os.getpid()
+		with open(tmp, "wb") as fh:
+			fh.write(blob)
+		os.replace(tmp, path)
+		return True
+	except OSError as e:
+		print(f"Warning: could not write {what} cache: {e}", file=sys.stderr)
+		return False
+
+# --- GTK icon-theme.cache ---
+# gtk-update-icon-cache stores a big-endian hash table of icon name -> (directory, suffix flags)
+# in <theme root>/icon-theme.cache. The file is mapped read-only and probed in place, so a
+# themed lookup costs a few page faults instead of listing the theme's directories. Like GTK,
+# a cache older than its theme directory is stale; the theme is then scanned instead.
+def icon_name_hash(key): # GTK's icon_name_hash: h = h * 31 + c over signed chars, 32 bit
+	h = 0
+	for i, c in enumerate(key):
+		if c > 127:
+			c -= 256
+		h = (c if i == 0 else (h << 5) - h + c) & 0xffffffff
+	return h
+
+class GtkIconCache(object):
+	suffixFlags = {".xpm": 1, ".svg": 2, ".png": 4}
+
+	def __init__(self, root, rank): # rank: {subdir: position in rankDirectories order}
+		import mmap, struct
+		self.root = root
+		self.unpack = struct.unpack_from
+		with open(root + "/icon-theme.cache", "rb") as fh:
+			self.buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+		major, minor, self.hashOffset, dirListOffset = self.unpack(">HHII", self.buf, 0)
+		if major != 1:
+			raise ValueError("unsupported icon-theme.cache version %d.%d" % (major, minor))
+		self.dirs = [] # directory index -> (rank, or None for directories the theme does not list; name)
+		for i in range(self.unpack(">I", self.buf, dirListOffset)[0]):
+			off = self.unpack(">I", self.buf, dirListOffset + 4 + 4 * i)[0]
+			name = self.buf[off:self.buf.find(b"\0", off)].decode(errors="replace")
+			self.dirs.append((rank.get(name), name))
+		self.buckets = self.unpack(">I", self.buf, self.hashOffset)[0]
+		self.exts = [(self.suffixFlags[e], e) for e in image_file_prefix]
+
+	def lookup(self, name): # -> (rank, path) of the best ranked directory that has name, or None
+		key = name.encode()
+		if not key or not self.buckets:
+			return None
+		buf = self.buf
+		unpack = self.unpack
+		off = unpack(">I", buf, self.hashOffset + 4 + 4 * (icon_name_hash(key) % self.buckets))[0]
+		key += b"\0"
+		while off != 0xffffffff:
+			chain, nameOff, imageList = unpack(">III", buf, off)
+			if buf[nameOff:nameOff + len(key)] == key:
+				best = None
+				for i in range(unpack(">I", buf, imageList)[0]):
+					dirIndex, flags = unpack(">HH", buf, imageList + 4 + 8 * i)
+					rank, subdir = self.dirs[dirIndex]
+					if rank is None or (best is not None and rank >= best[0]):
+						continue
+					for flag, ext in self.exts: # png before svg before xpm
+						if flags & flag:
+							best = (rank, self.root + "/" + subdir + "/" + name + ext)
+							break
+				return best
+			off = chain
+		return None
+
+class CachedThemeIndex(object):
+	# {name: path} view over the icon-theme.cache files of all roots of one theme
+	def __init__(self, caches):
+		self.caches = caches
+
+	def get(self, name, default=None):
+		best = None
+		for cache in self.caches: # on equal rank an earlier base wins, as in the directory scan
+			hit = cache.lookup(name)
+			if hit is not None and (best is None or hit[0] < best[0]):
+				best = hit
+		return best[1] if best is not None else default
+
+# --- Icon index cache ---
+class ThemeIndex(object):
+	# {name: path} view of one scanned theme, kept small for the resident modes: every directory
+	# is stored once, names are sorted for bisect, and per name only a directory number and an
+	# extension number are kept in arrays instead of a full path string.
+	__slots__ = ("dirs", "exts", "names", "dirIndex", "extIndex")
+
+	def __init__(self, dirs, exts, found): # found: {name: (directory number, extension number)}
+		self.dirs = dirs
+		self.exts = exts
+		self.names = sorted(found)
+		self.dirIndex = array("I", [found[n][0] for n in self.names])
+		self.extIndex = array("B", [found[n][1] for n in self.names])
+
+	def state(self): # plain data for the pickle, which must not name this class (it is __main__ when run as a script)
+		return (self.dirs, self.exts, self.names, self.dirIndex, self.extIndex)
+
+	@classmethod
+	def fromState(cls, state):
+		this = cls.__new__(cls)
+		this.dirs, this.exts, this.names, this.dirIndex, this.extIndex = state
+		return this
+
+	def get(self, name, default=None):
+		i = bisect_left(self.names, name)
+		if i < len(self.names) and self.names[i] == name:
+			return self.dirs[self.dirIndex[i]] + "/" + name + self.exts[self.extIndex[i]]
+		return default
+
+class IconIndex(object):
+	# Every theme is walked once and stored as a {icon name: path} map (best ranked directory wins)
+	# together with the mtimes of every directory that was listed. A warm run only stats those
+	# directories; a theme is walked again only when one of them (or its index.theme / icon-theme.cache) changed.
+	# The directories come from index.theme (or, without one, from walking the theme) and are
+	# listed on a pool of jobs threads, so a big theme costs its real directories in parallel.
+	def __init__(self, icon_dirs, cache_dir, jobs=1):
+		self.icon_dirs = list(icon_dirs)
+		self.cache_file = cache_dir + "/icons.pickle"
+		self.jobs = jobs
+		self.key = (4, tuple(self.icon_dirs), icon_size, image_file_prefix) # bump when the walk changes
+		self.themes = {}
+		self.dirty = False
+		self.checked = {} # theme -> index whose stamp was already verified in this run
+		self.lock = threading.Lock() # parse workers must not scan the same theme twice
+		self.load()
+
+	def load(self):
+		import pickle
+		try:
+			with open(self.cache_file, "rb") as fh:
+				data = pickle.load(fh)
+			if data.get("key") == self.key:
+				self.themes = {theme: (stamp, ThemeIndex.fromState(state)) for theme, (stamp, state) in data["themes"].items()}
+		except Exception: # missing, truncated or from an older version - just rebuild
+			self.themes = {}
+
+	def save(self):
+		themes = {theme: (stamp, index.state()) for theme, (stamp, index) in self.themes.items()}
+		if self.dirty and writeCache(self.cache_file, {"key": self.key, "themes": themes}, "icon"):
+			self.dirty = False
+
+	def recheck(self): # stamps are checked again, so only changed themes get rescanned
+		self.checked.clear()
+
+	def info(self, theme): # -> (index.theme path or None, parsed sections) from the first base that has one
+		for base in self.icon_dirs:
+			path = base + "/" + theme + "/index.theme"
+			try:
+				return path, readIndexTheme(path)
+			except (IOError, OSError):
+				continue 
+		return None, {}
+
+	def inherits(self, theme):
+		meta = self.info(theme)[1].get("Icon Theme", {})
+		return [t.strip() for t in meta.get("Inherits", "").split(",") if t.strip()]
+
+	def scan(self, theme): # walk one theme, returns (stamp, ThemeIndex)
+		index = {} # name -> (directory number, extension number)
+		dirs = []
+		exts = list(image_file_prefix)
+		stamp = {}
+		extRank = {e: i for i, e in enumerate(image_file_prefix)}
+		indexFile, sections = self.info(theme)
+		roots = []
+		for base in self.icon_dirs:
+			root = base + "/" + theme
+			for f in (root, root + "/index.theme", root + "/icon-theme.cache"):
+				stamp[f] = mtimeOf(f)
+			if stamp[root]:
+				roots.append(root)
+		subdirs = themeDirectories(sections)
+		if subdirs is None: # no index.theme: rank what is actually there
+			walked = list(dict.fromkeys(sub for root in roots for sub in walkThemeRoot(root)))
+			subdirs = rankDirectories(walked, {sub: guessedDirectory(sub) for sub in walked})
+		paths = [root + "/" + sub for sub in subdirs for root in roots]
+		if self.jobs > 1 and len(paths) > 1:
+			from concurrent.futures import ThreadPoolExecutor
+			with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+				listings = dict(zip(paths, pool.map(listIconDir, paths)))
+		else:
+			listings = {path: listIconDir(path) for path in paths}
+		for sub in subdirs: # merged in rank order, so the result does not depend on the listing order
+			found = {}
+			for root in roots: # the same subdirectory in an earlier base shadows later ones
+				tmp = root + "/" + sub
+				listing = listings[tmp]
+				if listing is None:
+					continue 
+				files, stamp[tmp] = listing
+				parent = os.path.dirname(tmp)
+				if parent not in stamp:
+					stamp[parent] = mtimeOf(parent) # catches newly added size/context directories
+				d = None
+				for x in files:
+					name, dot, ext = x.rpartition(".")
+					r = extRank.get("." + ext.lower())
+					if r is None or name in index:
+						continue 
+					prev = found.get(name)
+					if prev is None or r < prev[0]: # png before svg before xpm
+						if d is None:
+							d = len(dirs)
+							dirs.append(tmp)
+						ext = "." + ext
+						if ext != exts[r]: # .PNG and friends keep their spelling
+							if ext not in exts:
+								exts.append(ext)
+							found[name] = (r, d, exts.index(ext))
+						else:
+							found[name] = (r, d, r)
+			for name, (r, d, e) in found.items():
+				index[name] = (d, e)
+		return stamp, ThemeIndex(dirs, exts, index)
+
+	def openCaches(self, theme): # CachedThemeIndex if every root of theme has a fresh icon-theme.cache, else None
+		caches = []
+		rank = None
+		for base in self.icon_dirs:
+			root = base + "/" + theme
+			stats.count("stat")
+			try:
+				rootMtime = os.stat(root).st_mtime_ns
+			except OSError:
+				continue
+			stats.count("stat")
+			try:
+				if os.stat(root + "/icon-theme.cache").st_mtime_ns < rootMtime:
+					return None # icons were added after gtk-update-icon-cache ran
+				if rank is None:
+					subdirs = themeDirectories(self.info(theme)[1])
+					if subdirs is None: # gtk-update-icon-cache needs index.theme too, this cache is not ours to trust
+						return None
+					rank = {sub: pos for pos, sub in enumerate(subdirs)}
+				caches.append(GtkIconCache(root, rank))
+			except Exception: # missing, unreadable or not a cache we understand
+				return None
+		return CachedThemeIndex(caches) if caches else None
+
+	def get(self, theme):
+		index = self.checked.get(theme)
+		if index is not None:
+			return index
+		with self.lock:
+			index = self.checked.get(theme)
+			if index is not None:
+				return index
+			with stats.timer("icon-index"):
+				cached = self.themes.get(theme)
+				index = self.openCaches(theme)
+				if index is not None:
+					stats.count("icon_themes_mmapped")
+					if cached is not None: # the mapped cache replaces our own index of this theme
+						del self.themes[theme]
+						self.dirty = True
+				elif cached is not None and stampIsCurrent(cached[0]):
+					index = cached[1]
+					stats.count("icon_themes_cached")
+				else:
+					stamp, index = self.scan(theme)
+					self.themes[theme] = (stamp, index)
+					self.dirty = True
+					stats.count("icon_themes_scanned")
+			self.checked[theme] = index
+		return index
+
+# --- PATH executable index ---
+# One os.scandir pass per $PATH directory builds the set of executable names used for all
+# Exec=/TryExec= checks. Each directory's names are cached with its mtime, so a warm run
+# costs one stat per PATH entry.
+def scanPathDir(d):
+	names = set()
+	stats.count("listdir")
+	try:
+		with os.scandir(d) as it:
+			for entry in it:
 				try:
-					List.extend(tmp + "/" +  x for x in os.listdir(tmp) if x.lower().endswith(image_file_prefix))
-				except IOError:
-					continue
-	return List
-
-def which(program): #check if program exist
-	def is_exe(fpath):
-		return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-	fpath, fname = os.path.split(program)
-	if fpath:
-		if is_exe(program):
-			return program
-	else:
-		for path in os.environ["PATH"].split(os.pathsep):
-			exe_file = os.path.join(path, program)
-			if is_exe(exe_file):
-				return exe_file
-	return None
-
-# Helper to find specific icons for the footer
-def find_best_icon(possible_names):
-	for name in possible_names:
-		# Search in our generated iconList
-		# look for /name.png or /name.svg
-		matches = [s for s in iconList if "/" + name + "." in s or "/" + name + "-" in s]
-		if len(matches) > 0:
-			matches.sort(key=len)
-			return matches[0]
-	return ""
+					if entry.is_file() and entry.stat().st_mode & 0o111:
+						names.add(entry.name)
+				except OSError: # dangling symlink and the like
+					continue 
+	except OSError:
+		pass
+	return frozenset(names)
+
+class PathIndex(object):
+	def __init__(self, cache_dir):
+		self.cache_file = cache_dir + "/path.pickle"
+		self.names = None
+		self.absolute = {} # memo for Exec lines that use a path instead of a bare name
+		self.lock = threading.Lock()
+
+	def load(self):
+		import pickle
+		try:
+			with open(self.cache_file, "rb") as fh:
+				cached = pickle.load(fh)
+		except Exception:
+			cached = {}
+		dirs = {}
+		dirty = False
+		for d in dict.fromkeys(os.environ.get("PATH", "").split(os.pathsep)):
+			if not d:
+				continue 
+			mtime = mtimeOf(d)
+			hit = cached.get(d)
+			if hit is None or hit[0] != mtime:
+				hit = (mtime, scanPathDir(d))
+				dirty = True
+			dirs[d] = hit
+		self.names = set().union(*(names for mtime, names in dirs.values()))
+		if dirty or len(dirs) != len(cached):
+			writeCache(self.cache_file, dirs, "PATH")
+
+	def is_executable(self, program): #check if program exist
+		if "/" in program:
+			ok = self.absolute.get(program)
+			if ok is None:
+				stats.count("stat")
+				ok = self.absolute[program] = os.path.isfile(program) and os.access(program, os.X_OK)
+			return ok
+		if self.names is None:
+			with self.lock:
+				if self.names is None:
+					with stats.timer("path-index"):
+						self.load()
+		return program in self.names
+
+class IconResolver(object):
+	# exact-name icon lookup following the freedesktop icon theme spec:
+	# selected theme, its Inherits (depth first), hicolor, then the pixmaps directories.
+	# Every name is resolved at most once per run; misses are remembered as "". With a renderer
+	# the paths handed out are its pre-rendered copies.
+	def __init__(self, index, theme, pixmap_dirs, renderer=None):
+		self.index = index
+		self.theme = theme
+		self.pixmap_dirs = pixmap_dirs
+		self.renderer = renderer
+		self.chain = []
+		self.addTheme(theme)
+		if "hicolor" not in self.chain:
+			self.chain.append("hicolor")
+		self.found = {}
+
+	def addTheme(self, theme):
+		if theme in self.chain:
+			return
+		self.chain.append(theme)
+		for parent in self.index.inherits(theme):
+			self.addTheme(parent)
+
+	def lookup(self, name):
+		path = self.found.get(name)
+		if path is not None:
+			stats.count("icon_memo_hits")
+			return path
+		with stats.timer("icon-lookup"):
+			path = self.resolve(name)
+		stats.count("icon_hits" if path else "icon_misses")
+		path = self.render(path)
+		self.found[name] = path
+		return path
+
+	def render(self, path): # the icon file the menu should point at
+		if self.renderer is None or not path:
+			return path
+		return self.renderer.render(path)
+
+	def resolve(self, name):
+		path = ""
+		for theme in self.chain: # themes further down the chain are only indexed on a miss
+			path = self.index.get(theme).get(name, "")
+			if path:
+				break
+		else:
+			for pdir in self.pixmap_dirs:
+				for ext in image_file_prefix:
+					stats.count("stat")
+					if os.path.isfile(pdir + "/" + name + ext):
+						path = pdir + "/" + name + ext
+						break
+				if path:
+					break
+		return path
+
+	def find_best_icon(self, possible_names): # first of the names the theme has, for the footer
+		for name in possible_names:
+			path = self.lookup(name)
+			if path:
+				return path
+		return ""
+
+# --- Pre-rendered menu icons (--render-icons) ---
+# Theme icons are often scalable SVGs or 256px PNGs that labwc decodes and scales the first time
+# the menu opens. Here every resolved icon is rendered once to the menu size (a multiple of it for
+# HiDPI outputs) as a PNG in cache_dir/icons-<px>, named after the source path and mtime, so a
+# changed icon gets a new render and the old one is evicted after the next build. GdkPixbuf renders
+# every format; without it rsvg-convert handles SVGs and a PNG that already has the size is copied.
+# Anything that cannot be rendered keeps its theme path.
+def png_size(path): # (width, height) from the IHDR chunk, None for anything that is not a PNG
+	import struct
+	try:
+		with open(path, "rb") as fh:
+			head = fh.read(24)
+	except OSError:
+		return None
+	if len(head) < 24 or head[:8] != b"\x89PNG\r\n\x1a\n":
+		return None
+	return struct.unpack(">II", head[16:24])
+
+class IconRenderer(object):
+	def __init__(self, cache_dir, size):
+		self.size = size
+		self.dir = cache_dir + "/icons-%d" % size
+		self.used = set() # render file names handed out since this renderer was created
+		self.lock = threading.Lock() # GdkPixbuf loaders are not guaranteed to be thread safe
+		self._pixbuf = None
+		self._rsvg = None
+
+	def pixbuf(self): # GdkPixbuf.Pixbuf, or False without python3-gobject
+		if self._pixbuf is None:
+			try:
+				import gi
+				gi.require_version("GdkPixbuf", "2.0")
+				from gi.repository import GdkPixbuf
+				self._pixbuf = GdkPixbuf.Pixbuf
+			except (ImportError, ValueError):
+				self._pixbuf = False
+		return self._pixbuf
+
+	def rsvg(self): # path of rsvg-convert, or "" when it is not installed
+		if self._rsvg is None:
+			import shutil
+			self._rsvg = shutil.which("rsvg-convert") or ""
+		return self._rsvg
+
+	def render(self, path): # -> the render of path, or path itself when it cannot be rendered
+		import hashlib
+		try:
+			st = os.stat(path)
+		except OSError:
+			return path
+		name = hashlib.sha1(f"{path}\0{st.st_mtime_ns}".encode()).hexdigest() + ".png"
+		out = self.dir + "/" + name
+		stats.count("stat", 2)
+		if os.path.exists(out):
+			stats.count("icons_render_reused")
+		else:
+			with stats.timer("icon-render"):
+				ok = self.renderTo(path, out)
+			if not ok:
+				stats.count("icons_render_failed")
+				return path
+			stats.count("icons_rendered")
+		with self.lock:
+			self.used.add(name)
+		return out
+
+	def renderTo(self, src, dst): # -> True when dst was written
+		import subprocess, shutil
+		size = self.size
+		tmp = "%s.%d.%d.tmp" % (dst, os.getpid(), threading.get_ident())
+		try:
+			os.makedirs(self.dir, exist_ok=True)
+			if self.pixbuf():
+				with self.lock:
+					self.pixbuf().new_from_file_at_scale(src, size, size, True).savev(tmp, "png", [], [])
+			elif src.endswith(".svg") and self.rsvg():
+				subprocess.run([self.rsvg(), "-w", str(size), "-h", str(size), "-a", "-o", tmp, src], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+			elif png_size(src) == (size, size):
+				shutil.copyfile(src, tmp)
+			else:
+				return False
+			os.replace(tmp, dst)
+			return True
+		except Exception: # unreadable or broken icon, or a renderer failure: the menu uses the source
+			try:
+				os.unlink(tmp)
+			except OSError:
+				pass
+			return False
+
+	def evict(self): # delete renders nothing has been handed since this renderer was created
+		try:
+			names = os.listdir(self.dir)
+		except OSError:
+			return
+		with self.lock:
+			stale = [n for n in names if n not in self.used]
+		for n in stale:
+			try:
+				os.unlink(self.dir + "/" + n)
+			except OSError:
+				pass
+		stats.count("icons_evicted", len(stale))
+
+def iconName(data): # strip a file extension some .desktop files put on theme icon names
+	name, dot, ext = data.rpartition(".")
+	if dot and "." + ext.lower() in image_file_prefix:
+		return name
+	return data
 
 class dtItem(object):
+	__slots__ = ("fileName", "Name", "GenericName", "Comment", "Keywords", "Exec", "Terminal", "Type", "Icon", "IconName", "Group", "ExecProgram", "TryExec", "OnlyShowIn", "NotShowIn", "fileId", "sortKey")
+
 	def __init__(self, fName):
 		self.fileName = fName
 		self.Name = ""
+		self.GenericName = ""
 		self.Comment = ""
+		self.Keywords = () # only searched (--index), never shown
 		self.Exec = ""
 		self.Terminal = None
 		self.Type = ""
 		self.Icon = ""
-		self.Categories = ()
+		self.IconName = ""
+		self.Group = "" # menu group from Categories (see CategoryTable), "" keeps the entry out of the menu
+		self.ExecProgram = None # program of the Exec line; None without one, "" for an empty Exec=
+		self.TryExec = ""
+		self.OnlyShowIn = ()
+		self.NotShowIn = ()
+		self.fileId = "" # desktop-file ID, set by MenuBuilder.load_entry
+		self.sortKey = "" # lower-cased display name, set by MenuBuilder.load_entry
+
+	record_fields = ("Name", "GenericName", "Comment", "Keywords", "Exec", "Terminal", "Type", "IconName", "Group", "ExecProgram", "TryExec", "OnlyShowIn", "NotShowIn")
+
+	def record(self): # plain tuple of the parsed fields for the desktop cache
+		return tuple(getattr(self, f) for f in self.record_fields)
 
-	def addName(self, data):
-		self.Name = xescape(data)
+	@classmethod
+	def fromRecord(cls, fName, rec):
+		this = cls(fName)
+		for f, v in zip(cls.record_fields, rec):
+			setattr(this, f, v)
+		return this
+
+	def addName(self, data): # kept raw, the emitter escapes
+		self.Name = data
 
 	def addComment(self, data):
 		self.Comment = data
@@ -183,40 +1035,35 @@ class dtItem(object):
 			data = cmd + (' ' + args if args else '')
 		self.Exec = data
 
-	def addIcon(self, data):
+	def addIcon(self, data): # only remembered while parsing, see resolveIcon
+		self.IconName = data.strip()
+
+	def resolveIcon(self, resolver):
 		self.Icon = ""
-		if image_cat_prefix == "":
-			return
-		image_dir = image_dir_base[0] + "/pixmaps/"
-		di = data.strip()
+		di = self.IconName
 		if len(di) < 3:
 			#"Error in %s: Invalid or no icon '%s'" % (self.fileName,  di)
 			return
 		dix = di.find("/")     # is it a full path? 
 		if dix >= 0 and dix <= 2:    # yes, its a path (./path or ../path or /path ...)
-			self.Icon = di
+			self.Icon = resolver.render(di)
 			return
 		#else a short name like "myapp"
-		tmp = glob.glob(image_dir + di + ".*")
-		if len(tmp) == 0: #if there is not correct icon in pixmap, check for icon theme
-			for theme in iconThemes:
-				tmp=[s for s in iconList if di in s] 
-				if len(tmp) > 0:
-					break # end loop if found
-				else:
-					addIconsToList(iconList, theme)
-		if len(tmp) == 1 and tmp[0] != "/":
-			self.Icon = tmp[0]
-		if len(tmp) > 1: # if there are duplicated icons take one that has the shortest name
-			temp=tmp[0] # assign first item to a temp path
-			flen=len(temp.split("/")[-1]) # split filepath with "/" and take last element of list
-			for fpath in tmp: # check filepath list for shortest filename
-				tlen=len(fpath.split("/")[-1]) # split filepath with / and take last element of list
-				if tlen<flen: # replace icon path with shorter filename path
-					flen=tlen # reallocate shortest filename length
-					temp=fpath # reallocate temp path
-			self.Icon = temp
-		return
+		self.Icon = resolver.lookup(iconName(di))
+
+	def execOk(self, pathIndex): # checked every run against the PATH index, so it is never stale in the cache
+		if self.TryExec and not pathIndex.is_executable(self.TryExec):
+			return False
+		if self.ExecProgram is None: # no Exec line at all, shown as before
+			return True
+		return bool(self.ExecProgram) and pathIndex.is_executable(self.ExecProgram) # an empty Exec= has nothing to run
+
+	def shownIn(self, desktops): # OnlyShowIn / NotShowIn against the current desktops, decided per run like execOk
+		if not desktops: # nothing known (e.g. a unit without $XDG_CURRENT_DESKTOP), show rather than hide
+			return True
+		if self.OnlyShowIn and not any(d in self.OnlyShowIn for d in desktops):
+			return False
+		return not any(d in self.NotShowIn for d in desktops)
 
 	def addTerminal(self, data):
 		if data == "True" or data == "true":
@@ -227,452 +1074,1498 @@ class dtItem(object):
 	def addType(self, data):
 		self.Type = data
 
-	def addCategories(self, data):
-		self.Categories = data
-
-def getCatIcon(cat):
-	theme = selected_theme
-	cat = image_cat_prefix[0] + cat.lower()
-	if theme == "breeze" or theme == "breeze-dark":
-		if cat == "applications-editors": cat = "applications-education-language"
-		if cat == "applications-settings": cat = "applications-development"
-	if theme != "Adwaita" and theme != "gnome":
-		if cat == "applications-editors": cat = "applications-development"
-	if theme == "Adwaita":
-		if cat == "applications-multimedia": cat = "audio-speakers"
-	if theme == "Adwaita" or theme == "Papirus" or theme == "gnome":
-		if cat == "applications-editors": cat = "accessories-text-editor"
-		if cat == "applications-settings": cat = "preferences-desktop"
-		if cat == "applications-education": cat = "accessories-dictionary"
-	if theme != "breeze" or theme != "breeze-dark":
-		if cat == "applications-settings": cat = "preferences-desktop"
-	if theme == "Tango":
-		if cat == "applications-utilities": cat = "applications-accessories"
-	tmp = [s for s in iconList if cat in s]
-	if len(tmp) > 0:
-		return tmp[0]
-	return ""
-
-def xescape(s):
-	Rep = {"&":"&amp;", "<":"&lt;", ">":"&gt;",  "'":"&apos;", "\"":"&quot;"}
-	for p in ("&", "<", ">",  "'","\""):
-		sl = len(s); last = -1
-		while last < sl:
-			i = s.find(p,  last+1)
-			if i < 0:
-				done = True
-				break
-			last = i
-			l = s[:i]
-			r = s[i+1:]
-			s = l + Rep[p] + r
-	return s
-
-def process_category(cat, curCats, aliases=group_aliases, appGroups=application_groups):
-	# first process aliases
-	if aliases.__contains__(cat):
-		if aliases[cat] == "":
-			return "" # ignore this one
-		cat = aliases[cat]
-	if cat in appGroups and cat not in curCats: # valid categories only and no doublettes, please
-		curCats.append(cat)
-		return cat
-	return ""
-
-def process_dtfile(dtf,  catDict):  # process this file & extract relevant info
-	active = False          # parse only after "[Desktop Entry]" line         
+	def addCategories(self, data, categories):
+		self.Group = categories.classify(data.split(";") if data else ("Other",))
+
+xescape_table = str.maketrans({"&":"&amp;", "<":"&lt;", ">":"&gt;",  "'":"&apos;", "\"":"&quot;"})
+
+def xescape(s): # one linear pass; every label, icon and command goes through here exactly once, at emit time
+	return s.translate(xescape_table)
+
+# --- Category table ---
+# The group settings above and menu-categories.conf compiled once into a direct
+# {desktop-entry category: (group, rank)} table, so filing an entry is one dict lookup per
+# category, and into per-theme {group: icon name} tables for the submenu icons.
+class CategoryTable(object):
+	unranked = 1000
+
+	def __init__(self):
+		self.ranks = {group: group_ranks.get(group, self.unranked) for group in application_groups}
+		self.aliases = dict(group_aliases)
+		self.icons = dict(category_icons)
+		self.themeIcons = {theme: dict(names) for theme, names in theme_category_icons.items()}
+		self.compile()
+
+	@classmethod
+	def load(cls, paths): # built-in table plus the rules of the first readable file
+		table = cls()
+		for path in paths:
+			try:
+				with open(path, "r") as fh:
+					table.read(l.strip() for l in fh if l.strip() and not l.lstrip().startswith("#"))
+			except (IOError, OSError):
+				continue
+			table.compile()
+			break
+		return table
+
+	def read(self, rules):
+		for rule in rules:
+			words = rule.split()
+			try:
+				if words[0] == "group" and len(words) in (2, 3):
+					self.ranks[words[1]] = int(words[2]) if len(words) == 3 else self.ranks.get(words[1], self.unranked)
+				elif words[0] == "icon" and len(words) >= 3:
+					for theme in words[3:]:
+						self.themeIcons.setdefault(theme, {})[words[1]] = words[2]
+					if len(words) == 3:
+						self.icons[words[1]] = words[2]
+				elif "=" in rule:
+					cat, _, group = rule.partition("=")
+					self.aliases[cat.strip()] = "" if group.strip() == "-" else group.strip()
+				else:
+					raise ValueError("unknown rule")
+			except ValueError as e:
+				print(f"Warning: ignoring bad menu-categories.conf rule {rule!r}: {e}", file=sys.stderr)
+
+	def compile(self):
+		table = {group: (group, rank) for group, rank in self.ranks.items()}
+		for cat, group in self.aliases.items():
+			if group in self.ranks:
+				table[cat] = table[group]
+			else: # dropped ("" / "-") or mapped to something that is no group
+				table.pop(cat, None)
+		self.table = table
+		self.groups = sorted(self.ranks, key=str.lower) # display order
+		self.key = tuple(sorted(table.items())) # parsed entries are cached against this
+		self.themeTables = {}
+
+	def classify(self, cats): # group of the lowest ranked category that belongs to one (the first on ties), else ""
+		best = None
+		for cat in cats:
+			hit = self.table.get(cat)
+			if hit is not None and (best is None or hit[1] < best[1]):
+				best = hit
+		return best[0] if best is not None else ""
+
+	def iconNames(self, theme): # {group: icon name} for the submenus in this icon theme
+		names = self.themeTables.get(theme)
+		if names is None:
+			exceptions = self.themeIcons.get(theme, {})
+			names = self.themeTables[theme] = {group: exceptions.get(group) or self.icons.get(group) or "applications-" + group.lower() for group in self.groups}
+		return names
+
+# --- .desktop parse cache ---
+# Parsed entries are pickled per file path together with the file's (mtime, size) signature,
+# so a periodic run only stats the files and re-reads the ones that changed. The programs named
+# by Exec/TryExec are cached too and checked against the PATH index; the whole cache is dropped
+# when the category setup changes. There is one cache per application source, which also keeps
+# the source's last listing (see AppSource).
+class DesktopCache(object):
+	def __init__(self, cache_file, source=()):
+		self.cache_file = cache_file
+		self.source = source # kind and roots of the source, a different setup starts over
+		self.files = {} # path -> ((mtime, size), record or None)
+		self.listing = None # [(path, desktop-file ID)] of the last walk
+		self.stamp = {} # directory -> mtime when it was walked
+		self.dirty = False
+		self.load()
+
+	def key(self):
+		return (9, self.source)
+
+	def load(self):
+		import pickle
+		try:
+			with open(self.cache_file, "rb") as fh:
+				data = pickle.load(fh)
+			if data.get("key") == self.key():
+				self.files, self.listing, self.stamp = data["files"], data["listing"], data["stamp"]
+		except Exception: # missing, truncated or from an older version - just reparse
+			self.files, self.listing, self.stamp = {}, None, {}
+
+	def save(self, seen):
+		for dtf in [f for f in self.files if f not in seen]: # evict deleted (or no longer listed) files
+			del self.files[dtf]
+			self.dirty = True
+		if self.dirty and writeCache(self.cache_file, {"key": self.key(), "files": self.files, "listing": self.listing, "stamp": self.stamp}, "desktop"):
+			self.dirty = False
+
+def parse_dtfile(dtf, categories):  # read this file & extract relevant info, returns a dtItem or None
+	active = False          # parse only after "[Desktop Entry]" line
+	hidden = False          # NoDisplay=true / Hidden=true         
 	try:
-		with open(dtf, "r") as fh:
+		with open(dtf, "r", errors="replace") as fh: # a stray non-UTF-8 byte must not stop the run (or the watch service)
 			lines = fh.readlines()
 	except (IOError, OSError):
-		return  # Skip files we can't read
+		return None  # Skip files we can't read
 	this = dtItem(dtf)
 	for l in lines:
 		l = l.strip()
 		if l == "[Desktop Entry]":
 			active = True
-			continue
+			continue 
 		if active == False: # we don't care about licenses or other comments
-			continue
+			continue 
 		if l == None or len(l) < 1 or l[0] == '#':
-			continue
+			continue 
 		if l[0] == '[' and l !=  "[Desktop Entry]":
 			active = False
-			continue
+			continue 
 		eqi = l.split('=',1)
 		if len(eqi) < 2:
-			continue
+			continue 
 		if eqi[0] == "Name":
 			this.addName(eqi[1])
+		elif eqi[0] == "GenericName":
+			this.GenericName = eqi[1]
 		elif eqi[0] == "Comment":
 			this.addComment(eqi[1])
+		elif eqi[0] == "Keywords":
+			this.Keywords = tuple(k for k in eqi[1].split(";") if k)
 		elif eqi[0] == "Exec":
-			eqx=eqi[1].split(" ", 1)[0] 
-			if which(eqx) == None: 
-				return 
+			this.ExecProgram = eqi[1].split(" ", 1)[0]
 			this.addExec(eqi[1]) 
+		elif eqi[0] == "TryExec":
+			this.TryExec = eqi[1].strip()
 		elif eqi[0] == "Icon":
 			this.addIcon(eqi[1])
 		elif eqi[0] == "Terminal":
 			this.addTerminal(eqi[1])
 		elif eqi[0] == "Type":
 			if eqi[1] != "Application":
-				continue
+				continue 
 			this.addType(eqi[1])
 		elif eqi[0] == "Categories":
-			if eqi[1] == '':
-				eqi[1] = "Other"
-			if eqi[1][-1] == ';':
-				eqi[1] = eqi[1][0:-1]
-			cats = []
-			dtCats = eqi[1].split(';')
-			for cat in dtCats:
-				result = process_category(cat,  cats)
-			this.addCategories(cats)
+			this.addCategories(eqi[1], categories)
+		elif eqi[0] == "NoDisplay" or eqi[0] == "Hidden":
+			if eqi[1].strip() == "true":
+				hidden = True
+		elif eqi[0] == "OnlyShowIn":
+			this.OnlyShowIn = tuple(d for d in eqi[1].split(";") if d)
+		elif eqi[0] == "NotShowIn":
+			this.NotShowIn = tuple(d for d in eqi[1].split(";") if d)
 		else:
+			continue 
+	if hidden:
+		return None
+	return this
+
+class IgnoreRules(object):
+	# menu-ignore.conf compiled once: exact IDs go into a set, globs and regexes into one
+	# alternation that has to match the whole desktop-file ID. Checked before a file is opened.
+	# desktops: rules list the desktops OnlyShowIn/NotShowIn are matched against (see show_in_desktops).
+	def __init__(self, rules=()):
+		import re, fnmatch
+		self.ids = set()
+		self.desktops = None # None: no desktops: rule, use show_in_desktops
+		patterns = []
+		for rule in rules:
+			kind, sep, value = rule.partition(":")
+			if not sep or kind not in ("id", "glob", "re", "desktops"):
+				kind, value = "id", rule
+			if kind == "id":
+				self.ids.add(value)
+			elif kind == "desktops":
+				self.desktops = (self.desktops or ()) + tuple(d.strip() for d in value.split(";") if d.strip())
+			elif kind == "glob":
+				patterns.append(fnmatch.translate(value))
+			else:
+				try:
+					re.compile(value)
+				except re.error as e:
+					print(f"Warning: ignoring bad menu-ignore.conf regex {value!r}: {e}", file=sys.stderr)
+					continue
+				patterns.append(value)
+		self.pattern = re.compile("|".join("(?:%s)" % p for p in patterns)) if patterns else None
+
+	@classmethod
+	def load(cls, paths): # rules from the first readable file, no rules when there is none
+		for path in paths:
+			try:
+				with open(path, "r", errors="replace") as fh:
+					return cls(l.strip() for l in fh if l.strip() and not l.lstrip().startswith("#"))
+			except (IOError, OSError):
+				continue
+		return cls()
+
+	def matches(self, fileId):
+		return fileId in self.ids or (self.pattern is not None and self.pattern.fullmatch(fileId) is not None)
+
+def walk_applications(root, scannedDirs): # yields (path, desktop-file ID) below one applications dir
+	# the ID is the path relative to root with "/" turned into "-" (kde4/foo.desktop -> kde4-foo.desktop);
+	# names are sorted per directory so the order does not depend on the filesystem. scannedDirs gets
+	# {directory: mtime} of every directory listed, the mtime taken before listing it
+	stack = [(root, "")]
+	visited = set()
+	while stack:
+		path, prefix = stack.pop()
+		stats.count("listdir")
+		try:
+			st = os.stat(path)
+			if (st.st_dev, st.st_ino) in visited: # symlink loop
+				continue
+			visited.add((st.st_dev, st.st_ino))
+			with os.scandir(path) as it:
+				entries = sorted(it, key=lambda e: e.name)
+		except OSError:
 			continue
-	if len(this.Categories) > 0:       
-		# Priority order for category selection (higher priority wins)
-		category_priority = ["Games", "Multimedia", "Graphics", "Office", "Internet", "Editors", "System", "Settings", "Utilities", "Other"]
-		best_cat = this.Categories[0]
-		best_priority = 999
-		for cat in this.Categories:
-			if cat in category_priority:
-				priority = category_priority.index(cat)
-				if priority < best_priority:
-					best_priority = priority
-					best_cat = cat
-		catDict[best_cat].append(this)
-
-addIconsToList(iconList, selected_theme) 
-categoryDict = {}
-
-def print_custom_footer(handle, is_static, show_icons=True):
-	# Quick launch items at top level
-	quick_items = [
-		{
-			"label": "Terminal", 
-			"action": "Execute", 
-			"cmd": "alacritty", 
-			"icons": ["utilities-terminal", "terminal", "org.gnome.Terminal"]
-		},
-		{
-			"label": "File Manager", 
-			"action": "Execute", 
-			"cmd": "pcmanfm-qt", 
-			"icons": ["system-file-manager", "folder", "org.gnome.Files"]
-		},
-		{
-			"label": "Web Browser", 
-			"action": "Execute", 
-			"cmd": "firefox", 
-			"icons": ["firefox", "web-browser", "internet-web-browser"]
-		},
-	]
-	
-	# Config submenu items
-	config_items = [
-		{
-			"label": "Reconfigure Labwc", 
-			"action": "Reconfigure", 
-			"cmd": None, 
-			"icons": ["view-refresh", "reload", "preferences-system"]
-		},
-		{
-			"label": "Update Menu", 
-			"action": "Execute", 
-			"cmd": "~/.config/labwc/scripts/menu-update.sh", 
-			"icons": ["view-refresh", "reload", "system-software-update"]
-		},
-		{"separator": True},
-		{
-			"label": "Sync GTK Theme", 
-			"action": "Execute", 
-			"cmd": "~/.config/labwc/scripts/gtk.sh", 
-			"icons": ["preferences-desktop-theme", "preferences-desktop", "gtk-preferences"]
-		},
-		{
-			"label": "Restart Portals", 
-			"action": "Execute", 
-			"cmd": "systemctl --user restart xdg-desktop-portal", 
-			"icons": ["view-refresh", "preferences-system", "system-run"]
-		},
-		{"separator": True},
-		{
-			"label": "Edit Labwc Config", 
-			"action": "Execute", 
-			"cmd": "xdg-open ~/.config/labwc/labwc.xml", 
-			"icons": ["text-editor", "accessories-text-editor", "gedit"]
-		},
-		{
-			"label": "Edit Theme", 
-			"action": "Execute", 
-			"cmd": "xdg-open ~/.local/share/themes/NIGHT-RED/openbox-3/themerc", 
-			"icons": ["preferences-desktop-theme", "preferences-desktop", "applications-graphics"]
-		},
-	]
-
-	# Session submenu items (Openbox-style)
-	session_items = [
-		{
-			"label": "Lock Screen", 
-			"action": "Execute", 
-			"cmd": "loginctl lock-session", 
-			"icons": ["system-lock-screen", "lock", "preferences-desktop-screensaver"]
-		},
-		{
-			"label": "Suspend", 
-			"action": "Execute", 
-			"cmd": "systemctl suspend", 
-			"icons": ["system-suspend", "sleep", "gnome-session-suspend"]
-		},
-		{
-			"label": "Hibernate", 
-			"action": "Execute", 
-			"cmd": "systemctl hibernate", 
-			"icons": ["system-hibernate", "gnome-session-hibernate"]
-		},
-		{"separator": True},
-		{
-			"label": "Log Out", 
-			"action": "Exit", 
-			"cmd": None, 
-			"icons": ["system-log-out", "gnome-logout", "exit"]
-		},
-		{
-			"label": "Reboot", 
-			"action": "Execute", 
-			"cmd": "systemctl reboot", 
-			"icons": ["system-reboot", "view-refresh", "gnome-session-reboot"]
-		},
-		{
-			"label": "Shutdown", 
-			"action": "Execute", 
-			"cmd": "systemctl poweroff", 
-			"icons": ["system-shutdown", "gnome-shutdown", "power-off"]
-		},
-	]
-
-	def write_item(item, indent="        "):
-		if item.get("separator"):
-			if is_static:
-				handle.write(f'{indent}<separator />\n')
+		scannedDirs[path] = st.st_mtime_ns
+		subdirs = []
+		for entry in entries:
+			if entry.name.endswith(".desktop"):
+				yield entry.path, prefix + entry.name
 			else:
-				print("<separator />")
+				try:
+					if entry.is_dir():
+						subdirs.append((entry.path, prefix + entry.name + "-"))
+				except OSError:
+					continue
+		stack.extend(reversed(subdirs)) # depth first, in name order
+
+def list_executables(root, scannedDirs): # sorted (path, name) of the executable files directly in root
+	stats.count("listdir")
+	try:
+		mtime = os.stat(root).st_mtime_ns
+		with os.scandir(root) as it:
+			found = sorted((e.path, e.name) for e in it if e.is_file() and os.access(e.path, os.X_OK))
+	except OSError:
+		return []
+	scannedDirs[root] = mtime
+	return found
+
+def appimage_name(fileName): # "Krita-5.2.2-x86_64.AppImage" -> "Krita"
+	words = []
+	for word in fileName.rsplit(".", 1)[0].replace("_", "-").split("-"):
+		if not word or word[0].isdigit() or word.lower() in ("x86", "64", "amd64", "aarch64", "arm64", "armhf", "i386", "i686"):
+			break
+		words.append(word)
+	return " ".join(words) or fileName
+
+# --- Application sources ---
+# An AppSource lists (path, desktop-file ID) pairs, highest precedence first, and turns one path
+# into a dtItem. Its listing is kept in its own cache (cache_dir/source-<name>.pickle) next to the
+# parsed entries and the mtimes of every directory it looked at, so a run walks again only the
+# sources whose directories changed, and only their caches are rewritten.
+class AppSource(object):
+	kind = "desktop" # .desktop files below the roots, like $XDG_DATA_DIRS/applications
+
+	def __init__(self, name, roots, cache_dir, categories):
+		self.name = name
+		self.roots = tuple(roots)
+		self.categories = categories
+		self.cache = DesktopCache(cache_dir + "/source-" + name + ".pickle", (self.kind, self.roots, categories.key))
+
+	def walk(self, scannedDirs):
+		entries = []
+		for root in self.roots:
+			entries.extend(walk_applications(root, scannedDirs))
+		return entries
+
+	def listing(self): # -> [(path, ID)]
+		cache = self.cache
+		if cache.listing is not None and stampIsCurrent(cache.stamp):
+			stats.count("sources_cached")
+			return cache.listing
+		scannedDirs = {}
+		cache.listing = self.walk(scannedDirs)
+		for root in self.roots: # a missing root is stamped 0, so it counts as a change once it appears
+			scannedDirs.setdefault(root, 0)
+		cache.stamp = scannedDirs
+		cache.dirty = True
+		stats.count("sources_walked")
+		return cache.listing
+
+	def scannedDirs(self): # directories the listing came from, for watch mode and --check
+		return [d for d, mtime in self.cache.stamp.items() if mtime]
+
+	def parse(self, path):
+		return parse_dtfile(path, self.categories)
+
+class ExecutableSource(AppSource):
+	# executables without a .desktop file, the entry is made up from the file name (in "Other")
+	kind = "local-bin"
+
+	def wanted(self, fileName):
+		return not fileName.lower().endswith(".appimage") # those belong to the appimage source
+
+	def label(self, fileName):
+		return fileName
+
+	def walk(self, scannedDirs):
+		entries = []
+		for root in self.roots:
+			entries.extend((path, self.kind + "-" + fileName) for path, fileName in list_executables(root, scannedDirs) if self.wanted(fileName))
+		return entries
+
+	def parse(self, path):
+		import shlex
+		this = dtItem(path)
+		this.addName(self.label(os.path.basename(path)))
+		this.Exec = shlex.quote(path)
+		this.ExecProgram = path
+		this.Terminal = False
+		this.addType("Application")
+		this.addCategories("", self.categories)
+		return this
+
+class AppImageSource(ExecutableSource):
+	kind = "appimage"
+
+	def wanted(self, fileName):
+		return fileName.lower().endswith(".appimage")
+
+	def label(self, fileName):
+		return appimage_name(fileName)
+
+source_kinds = {"desktop": AppSource, "local-bin": ExecutableSource, "appimage": AppImageSource}
+
+def app_sources(config, categories): # AppSource per name in config.sources, directories walked by an earlier desktop source left out
+	sources = []
+	claimed = set()
+	for name in config.sources:
+		if name not in config.source_roots:
+			print("menu-generator: unknown application source %s" % name, file=sys.stderr)
+			continue
+		kind, roots = config.source_roots[name]
+		if kind == "desktop":
+			roots = [r for r in roots if r not in claimed]
+			claimed.update(roots)
+		sources.append(source_kinds[kind](name, roots, config.cache_dir, categories))
+	return sources
+
+def capitalize(name): # first letter of every word, the rest untouched
+	return ' '.join([word[:1].upper() + word[1:] for word in name.split(' ')])
+
+def sortKeyOf(app):
+	return app.sortKey
+
+def launch_command(app): # what the menu item runs
+	return f"{terminal_string} {app.Exec}" if app.Terminal else app.Exec
+
+class Menu(object):
+	# The menu model build() returns:
+	# categories - [(group name, icon path, [dtItem sorted by Name])] in display order, empty groups left out
+	# footer     - nodes as in the footer_* lists, "icon" resolved and submenus as {"id", "label", "icon", "items"}
+	def __init__(self, categories, footer):
+		self.categories = categories
+		self.footer = footer
+
+class MenuBuilder(object):
+	# MenuBuilder(config).build() -> Menu. Theme, icon index, PATH index and application sources are
+	# created on first use, so a builder is cheap until it actually has to build. The parsed
+	# entries stay in memory; build(changed) only reloads the files named in changed (watch/daemon).
+	def __init__(self, config=None):
+		self.config = config if config is not None else MenuConfig()
+		self.entries = {} # desktop file -> parsed dtItem, or None when it cannot be used whatever the PATH
+		self.desktopIds = {}
+		self.sourceOf = {} # desktop file -> the AppSource that listed it
+		self.scannedDirs = []
+		self.initLock = threading.RLock() # the lazy state below is first touched from parse workers
+		self._theme = None
+		self._icons = None
+		self._resolver = None
+		self._path = None
+		self._sources = None
+		self._ignore = None
+		self._desktops = None
+		self._categories = None
+
+	@property
+	def ignore(self):
+		with self.initLock:
+			if self._ignore is None:
+				self._ignore = IgnoreRules.load(self.config.ignore_files)
+			return self._ignore
+
+	@property
+	def theme(self):
+		with self.initLock:
+			if self._theme is None:
+				with stats.timer("settings"):
+					self._theme = installed_icon_theme(self.config.icon_theme or detect_icon_theme(self.config.home), self.config.icon_dirs)
+			return self._theme
+
+	@property
+	def icons(self):
+		with self.initLock:
+			if self._icons is None:
+				self._icons = IconIndex(self.config.icon_dirs, self.config.cache_dir, self.config.jobs)
+			return self._icons
+
+	@property
+	def resolver(self):
+		with self.initLock:
+			if self._resolver is None:
+				with stats.timer("icon-setup"):
+					renderer = IconRenderer(self.config.cache_dir, self.config.render_size) if self.config.render_size else None
+					self._resolver = IconResolver(self.icons, self.theme, self.config.pixmap_dirs, renderer)
+			return self._resolver
+
+	@property
+	def path(self):
+		with self.initLock:
+			if self._path is None:
+				self._path = PathIndex(self.config.cache_dir)
+			return self._path
+
+	@property
+	def categories(self):
+		with self.initLock:
+			if self._categories is None:
+				self._categories = CategoryTable.load(self.config.category_files)
+			return self._categories
+
+	@property
+	def sources(self):
+		with self.initLock:
+			if self._sources is None:
+				self._sources = app_sources(self.config, self.categories)
+			return self._sources
+
+	def sourceRoots(self):
+		return [root for source in self.sources for root in source.roots]
+
+	def list_sources(self): # [(source, listing)], the sources listed concurrently
+		sources = self.sources
+		jobs = self.config.jobs
+		if jobs <= 1 or len(sources) < 2:
+			return [(source, source.listing()) for source in sources]
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor(max_workers=min(jobs, len(sources))) as pool:
+			return list(zip(sources, pool.map(AppSource.listing, sources)))
+
+	def list_dtfiles(self): # the highest precedence file for every desktop-file ID, shadowed copies are never opened
+		dtFiles = []
+		self.desktopIds = {} # path -> desktop-file ID
+		self.sourceOf = {}
+		seen = set()
+		shadowed = 0
+		listings = self.list_sources()
+		self.scannedDirs = [d for source in self.sources for d in source.scannedDirs()] # every directory walked, for watch mode
+		for source, listing in listings:
+			for dtf, fileId in listing:
+				if fileId in seen:
+					shadowed += 1
+					continue
+				seen.add(fileId)
+				self.desktopIds[dtf] = fileId
+				self.sourceOf[dtf] = source
+				dtFiles.append(dtf)
+		ignore = self.ignore
+		kept = [dtf for dtf in dtFiles if not ignore.matches(self.desktopIds[dtf])]
+		stats.count("files_shadowed", shadowed)
+		stats.count("files_ignored", len(dtFiles) - len(kept))
+		return kept
+
+	def load_entry(self, dtf):  # dtItem for this file (from the cache when unchanged), None if it cannot be read or parsed
+		stats.count("stat")
+		try:
+			st = os.stat(dtf)
+		except OSError:
+			return None
+		sig = (st.st_mtime_ns, st.st_size)
+		source = self.sourceOf[dtf]
+		desktop = source.cache
+		cached = desktop.files.get(dtf)
+		if cached is not None and cached[0] == sig:
+			this = dtItem.fromRecord(dtf, cached[1]) if cached[1] is not None else None
+			stats.count("files_cached")
+		else:
+			this = source.parse(dtf)
+			stats.count("files_parsed")
+			desktop.files[dtf] = (sig, this.record() if this is not None else None)
+			desktop.dirty = True
+		if this is None:
+			return None
+		this.fileId = self.desktopIds.get(dtf) or os.path.basename(dtf)
+		this.Name = capitalize(this.Name)
+		this.sortKey = this.Name.lower()
+		if self.config.show_icons:
+			if self.rejection(this) is None: # on the workers for what is shown now, the rest when build() files it
+				this.resolveIcon(self.resolver)
+			else:
+				this.Icon = None
+		return this
+
+	def rejection(self, this): # None, or the counter for why this entry is left out of the menu right now
+		# checked on every build, not only when the file is loaded: programs come and go with the PATH
+		if not this.execOk(self.path):
+			return "rejected_no_exec"
+		if not this.shownIn(self.desktops()):
+			return "rejected_not_shown"
+		return None
+
+	def load_entries(self, dtFiles): # load_entry over a worker pool, results stay in dtFiles order
+		jobs = self.config.jobs
+		if jobs <= 1 or len(dtFiles) < 2:
+			return [self.load_entry(dtf) for dtf in dtFiles]
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor(max_workers=jobs) as pool:
+			return list(pool.map(self.load_entry, dtFiles))
+
+	def desktops(self): # config.desktops ($XDG_CURRENT_DESKTOP) plus the desktops: rules, or show_in_desktops without any
+		with self.initLock:
+			if self._desktops is None:
+				extra = self.ignore.desktops
+				self._desktops = tuple(dict.fromkeys(self.config.desktops + (extra if extra is not None else show_in_desktops)))
+			return self._desktops
+
+	def dropIgnoreRules(self): # menu-ignore.conf is read again and every entry checked anew on the next build
+		with self.initLock:
+			self._ignore = None
+			self._desktops = None
+
+	def dropCategories(self): # menu-categories.conf is read again and every entry filed anew on the next build
+		with self.initLock:
+			self._categories = None
+			self._sources = None
+			self.entries.clear()
+
+	def reload_icons(self): # after an icon theme change: new resolver, icons of the kept entries resolved again
+		with self.initLock:
+			self.icons.recheck()
+			self._theme = None
+			self._resolver = None
+		if self.config.show_icons:
+			for this in self.entries.values():
+				if this is not None:
+					this.resolveIcon(self.resolver)
+
+	def footer(self):
+		find = self.resolver.find_best_icon if self.config.show_icons else (lambda names: "")
+		def node(item):
+			if item.get("separator"):
+				return item
+			return dict(item, icon=find(item["icons"]))
+		nodes = [{"separator": True}] + [node(item) for item in footer_quick_items] + [{"separator": True}]
+		for menuId, label, icons, items in footer_submenus:
+			nodes.append({"id": menuId, "label": label, "icon": find(icons), "items": [node(item) for item in items]})
+		return nodes
+
+	def build(self, changed=None): # -> Menu; changed=None reloads every file, otherwise only those in changed (and new ones)
+		cfg = self.config
+		with self.initLock:
+			self._path = None # new packages usually bring their binary along with the .desktop file
+		dtFiles = self.list_dtfiles()
+		stats.lap("discovery")
+		current = set(dtFiles)
+		for dtf in [f for f in self.entries if f not in current]:
+			del self.entries[dtf]
+		stale = [dtf for dtf in dtFiles if changed is None or dtf in changed or dtf not in self.entries]
+		self.entries.update(zip(stale, self.load_entries(stale)))
+		stats.lap("parse")
+		groups = self.categories.groups
+		catDict = {appGroup: [] for appGroup in groups}
+		for dtf in dtFiles: # glob order, so equal names sort the same way every run
+			this = self.entries[dtf]
+			if this is None:
+				continue
+			reason = self.rejection(this)
+			if reason is not None:
+				stats.count(reason)
+				continue
+			if not this.Group:
+				continue
+			if this.Icon is None: # was not usable when it was loaded
+				this.resolveIcon(self.resolver)
+			catDict[this.Group].append(this)
+		groupIcons = self.categories.iconNames(self.resolver.theme) if cfg.show_icons else {}
+		categories = []
+		for groupName in groups:
+			catList = catDict[groupName]
+			if len(catList) < 1:
+				continue 
+			with stats.timer("sort"):
+				catList.sort(key=sortKeyOf) # keys were computed once when the entry was loaded
+			groupIcon = self.resolver.lookup(groupIcons[groupName]) if cfg.show_icons else ""
+			categories.append((groupName, groupIcon, catList))
+		menu = Menu(categories, self.footer() if cfg.show_footer else [])
+		stats.lap("categorize")
+		self.save(current)
+		stats.lap("save-cache")
+		return menu
+
+	def inputs(self): # paths whose mtimes decide whether the next build can differ from the last one (--check, --lazy)
+		cfg = self.config
+		paths = list(self.scannedDirs) + [d for d in self.sourceRoots() if d not in self.scannedDirs] + list(cfg.ignore_files) + list(cfg.category_files)
+		paths += [d for d in os.environ.get("PATH", "").split(os.pathsep) if d]
+		if cfg.show_icons:
+			paths += list(gtk_settings_files(cfg.home)) + cfg.icon_dirs + cfg.pixmap_dirs
+			paths += [d + "/" + t for d in cfg.icon_dirs for t in self.resolver.chain]
+		return list(dict.fromkeys(paths))
+
+	def save(self, seen):
+		if self._icons is not None:
+			self._icons.save()
+		if self._resolver is not None and self._resolver.renderer is not None:
+			self._resolver.renderer.evict()
+		for source in self.sources:
+			source.cache.save(seen)
+
+# --- XML emission ---
+# One emitter renders the Menu model for both outputs; a MenuFormat only decides the layout
+# (document wrapper, indentation, one-line items, id prefix). Lines are collected in a list
+# and joined once, and text is escaped in the same place for both formats.
+class MenuFormat(object):
+	def __init__(self, head, tail, indent, depth, compact, idPrefix, closeComments):
+		self.head = head                   # lines before the first category
+		self.tail = tail                   # lines after the footer
+		self.indent = indent               # one nesting level
+		self.depth = depth                 # nesting level of the categories
+		self.compact = compact             # <item> on a single line
+		self.idPrefix = idPrefix           # category menu ids
+		self.closeComments = closeComments # "</menu> <!-- label -->"
+
+menu_formats = {
+	"static": MenuFormat(
+		head=('<?xml version="1.0" encoding="UTF-8"?>', '<openbox_menu >', '    <menu id="root-menu" label="Applications">'),
+		tail=('    </menu>', '</openbox_menu>'),
+		indent="    ", depth=2, compact=False, idPrefix="", closeComments=True),
+	"pipe": MenuFormat( # prefixed ids so a pipe menu can sit next to the static one
+		head=("<openbox_pipe_menu>",),
+		tail=("</openbox_pipe_menu>",),
+		indent="", depth=0, compact=True, idPrefix="openbox-", closeComments=False),
+}
+
+class MenuEmitter(object):
+	def __init__(self, fmt, icons=True, footer=True):
+		self.fmt = fmt
+		self.icons = icons
+		self.footer = footer
+		self.out = []
+
+	def line(self, depth, text):
+		self.out.append(self.fmt.indent * depth + text + "\n")
+
+	def labelAttrs(self, label, icon):
+		if icon and self.icons:
+			return f'label="{xescape(label)}" icon="{xescape(icon)}"'
+		return f'label="{xescape(label)}"'
+
+	def separator(self, depth):
+		self.line(depth, "<separator />")
+
+	def item(self, depth, label, icon, action, command):
+		attrs = self.labelAttrs(label, icon)
+		cmd = f"<command>{xescape(command)}</command>" if command else ""
+		if self.fmt.compact:
+			self.line(depth, f'<item {attrs}><action name="{action}">{cmd}</action></item>')
 			return
-		
-		iconPath = find_best_icon(item["icons"]) if show_icons else None
-		
-		if is_static:
-			handle.write(f'{indent}<item label="{item["label"]}"')
-			if iconPath:
-				handle.write(f' icon="{iconPath}"')
-			handle.write('>\n')
-			
-			handle.write(f'{indent}    <action name="{item["action"]}">\n')
-			if item["cmd"]:
-				escaped_cmd = xescape(item["cmd"])
-				handle.write(f'{indent}        <command>{escaped_cmd}</command>\n')
-			handle.write(f'{indent}    </action>\n')
-			handle.write(f'{indent}</item>\n')
+		self.line(depth, f"<item {attrs}>")
+		self.line(depth + 1, f'<action name="{action}">')
+		if cmd:
+			self.line(depth + 2, cmd)
+		self.line(depth + 1, "</action>")
+		self.line(depth, "</item>")
+
+	def openMenu(self, depth, menuId, label, icon):
+		self.line(depth, f'<menu id="{xescape(menuId)}" {self.labelAttrs(label, icon)}>')
+
+	def closeMenu(self, depth, label):
+		if self.fmt.closeComments:
+			self.line(depth, f"</menu> <!-- {xescape(label)} -->")
 		else:
-			out = f'<item label="{item["label"]}"'
-			if iconPath:
-				out += f' icon="{iconPath}"'
-			out += f'><action name="{item["action"]}">'
-			if item["cmd"]:
-				out += f'<command><![CDATA[{item["cmd"]}]]></command>'
-			out += '</action></item>'
-			print(out)
-
-	# Print Separator before footer
-	if is_static:
-		handle.write('        <separator />\n')
-	else:
-		print("<separator />")
+			self.line(depth, "</menu>")
 
-	# Print quick launch items
-	for item in quick_items:
-		write_item(item)
+	def footerNode(self, depth, node):
+		if node.get("separator"):
+			self.separator(depth)
+		elif "items" in node: # submenu
+			self.openMenu(depth, node["id"], node["label"], node["icon"])
+			for item in node["items"]:
+				self.footerNode(depth + 1, item)
+			self.closeMenu(depth, node["label"])
+		else:
+			self.item(depth, node["label"], node["icon"], node["action"], node["cmd"])
 
-	# Separator before submenus
-	if is_static:
-		handle.write('        <separator />\n')
-	else:
-		print("<separator />")
-
-	# Print Config submenu
-	configIcon = find_best_icon(["preferences-system", "preferences-desktop", "applications-system"]) if show_icons else None
-	if is_static:
-		handle.write('        <menu id="config-menu" label="Config"')
-		if configIcon:
-			handle.write(f' icon="{configIcon}"')
-		handle.write('>\n')
-		for item in config_items:
-			write_item(item, "            ")
-		handle.write('        </menu>\n')
-	else:
-		cfgMenuStr = '<menu id="config-menu" label="Config"'
-		if configIcon:
-			cfgMenuStr += f' icon="{configIcon}"'
-		cfgMenuStr += '>'
-		print(cfgMenuStr)
-		for item in config_items:
-			write_item(item, "")
-		print('</menu>')
-
-	# Print Session submenu (power/logout options)
-	sessionIcon = find_best_icon(["system-log-out", "gnome-logout", "preferences-system"]) if show_icons else None
-	if is_static:
-		handle.write('        <menu id="session-menu" label="Session"')
-		if sessionIcon:
-			handle.write(f' icon="{sessionIcon}"')
-		handle.write('>\n')
-		for item in session_items:
-			write_item(item, "            ")
-		handle.write('        </menu>\n')
+	def render(self, menu):
+		fmt = self.fmt
+		depth = fmt.depth
+		for text in fmt.head:
+			self.line(0, text)
+		for groupName, groupIcon, catList in menu.categories:
+			self.openMenu(depth, fmt.idPrefix + groupName, groupName, groupIcon)
+			for app in catList:
+				self.item(depth + 1, app.Name, app.Icon, "Execute", launch_command(app))
+			self.closeMenu(depth, groupName)
+		# --- CUSTOM FOOTER ---
+		if self.footer:
+			for node in menu.footer:
+				self.footerNode(depth, node)
+		for text in fmt.tail:
+			self.line(0, text)
+		return "".join(self.out)
+
+	def renderRoot(self, categories, footer, execute): # categories as nested pipe menus: [(name, icon)], execute(name) -> command
+		fmt = self.fmt
+		for text in fmt.head:
+			self.line(0, text)
+		for groupName, groupIcon in categories:
+			self.line(fmt.depth, f'<menu id="{xescape(fmt.idPrefix + groupName)}" {self.labelAttrs(groupName, groupIcon)} execute="{xescape(execute(groupName))}" />')
+		if self.footer:
+			for node in footer:
+				self.footerNode(fmt.depth, node)
+		for text in fmt.tail:
+			self.line(0, text)
+		return "".join(self.out)
+
+	def renderItems(self, items): # one category on its own: [(label, icon, command)]
+		for text in self.fmt.head:
+			self.line(0, text)
+		for label, icon, command in items:
+			self.item(self.fmt.depth, label, icon, "Execute", command)
+		for text in self.fmt.tail:
+			self.line(0, text)
+		return "".join(self.out)
+
+def render_menu(menu, fmt="static", icons=True, footer=True): # -> the whole document as one string
+	return MenuEmitter(menu_formats[fmt], icons, footer).render(menu)
+
+def render_json(menu, icons=True): # the app model for rofi, waybar and other consumers
+	import json
+	categories = []
+	for groupName, groupIcon, catList in menu.categories:
+		categories.append({"name": groupName, "icon": groupIcon if icons else "", "apps": [{
+			"id": app.fileId,
+			"name": app.Name,
+			"comment": app.Comment,
+			"exec": app.Exec,
+			"terminal": bool(app.Terminal),
+			"command": launch_command(app),
+			"icon": app.Icon if icons else "",
+			"file": app.fileName,
+		} for app in catList]})
+	return json.dumps({"version": 1, "categories": categories}, ensure_ascii=False, indent=1) + "\n"
+
+# --- Search index (--index / --query) ---
+# The app model flattened for launchers: one record per app, the words of every searchable field
+# sorted for prefix lookups (one flat array of app numbers, a slice per word and field), and the
+# trigrams of the name-like fields for substring and typo matches. The file is marshal data (built into the
+# interpreter, so --query does not even import pickle) with the arrays as raw bytes that are read
+# back as memoryviews; a search only loads it and ranks, it never opens a .desktop file or a theme.
+search_weights = (60, 45, 40, 15) # word prefix score for Name, GenericName, Keywords, Comment; a whole word adds a third
+search_fuzzy = 30 # score when every trigram of a word is shared, less for fewer (at least half)
+search_name_bonus = 25 # the name starts with the whole query
+
+def search_words(text): # lower-cased words, anything that is not a letter or digit separates them
+	return "".join([c if c.isalnum() else " " for c in text.lower()]).split()
+
+def trigrams(word):
+	return {word[i:i + 3] for i in range(len(word) - 2)}
+
+class SearchIndex(object):
+	version = 3
+	__slots__ = ("apps", "words", "wordStart", "wordPostings", "grams")
+
+	def __init__(self, apps, words, wordStart, wordPostings, grams):
+		self.apps = apps                 # [(id, name, generic name, comment, command, icon, group, lower-cased name)] in name order
+		self.words = words               # sorted unique words
+		self.wordStart = wordStart       # unsigned ints: apps with words[i] in field f are wordPostings[wordStart[4 * i + f]:wordStart[4 * i + f + 1]]
+		self.wordPostings = wordPostings # unsigned ints, app numbers
+		self.grams = grams               # trigram -> bytes of unsigned int app numbers
+
+	@classmethod
+	def fromMenu(cls, menu, icons=True):
+		apps = []
+		postings = {}
+		grams = {}
+		listed = sorted(((app, groupName) for groupName, groupIcon, catList in menu.categories for app in catList), key=lambda entry: entry[0].sortKey)
+		for app, groupName in listed: # app numbers follow the names, so equal scores rank by number
+			n = len(apps)
+			apps.append((app.fileId, app.Name, app.GenericName, app.Comment, launch_command(app), app.Icon if icons else "", groupName, app.sortKey))
+			for field, text in enumerate((app.Name, app.GenericName, " ".join(app.Keywords), app.Comment)):
+				for word in search_words(text):
+					if word not in postings:
+						postings[word] = (set(), set(), set(), set())
+					postings[word][field].add(n)
+					if field < 3: # comments are too chatty for fuzzy matches
+						for g in trigrams(word):
+							grams.setdefault(g, set()).add(n)
+		words = sorted(postings)
+		wordStart = array("I", [0])
+		wordPostings = array("I")
+		for word in words:
+			for ns in postings[word]:
+				wordPostings.extend(sorted(ns))
+				wordStart.append(len(wordPostings))
+		return cls(apps, words, wordStart, wordPostings, {g: array("I", sorted(grams[g])).tobytes() for g in sorted(grams)})
+
+	def dump(self): # -> bytes for MenuTarget; format 2 has no back references, so equal indexes give equal files
+		import marshal
+		return marshal.dumps((self.version, self.apps, self.words, bytes(self.wordStart), bytes(self.wordPostings), self.grams), 2)
+
+	@classmethod
+	def load(cls, path): # None when missing, unreadable or from another version
+		import marshal
+		try:
+			with open(path, "rb") as fh:
+				data = marshal.loads(fh.read())
+			version, apps, words, wordStart, wordPostings, grams = data
+		except Exception:
+			return None
+		if version != cls.version:
+			return None
+		return cls(apps, words, memoryview(wordStart).cast("I"), memoryview(wordPostings).cast("I"), grams)
+
+	def termScores(self, term): # {app number: score} for one query word
+		found = [] # (score, app numbers), merged lowest score first so every app keeps its best
+		words = self.words
+		start = self.wordStart
+		postings = self.wordPostings
+		i = bisect_left(words, term)
+		while i < len(words) and words[i].startswith(term):
+			whole = len(words[i]) == len(term)
+			for field, weight in enumerate(search_weights):
+				first, end = start[4 * i + field], start[4 * i + field + 1]
+				if first < end:
+					found.append((weight + weight // 3 if whole else weight, postings[first:end]))
+			i += 1
+		grams = trigrams(term)
+		if len(grams) == 1: # a three letter word: substring matches only
+			found.append((search_fuzzy, memoryview(self.grams.get(term, b"")).cast("I")))
+		elif grams:
+			from collections import Counter
+			shared = Counter()
+			for g in grams:
+				shared.update(memoryview(self.grams.get(g, b"")).cast("I")) # counted in C
+			need = (len(grams) + 1) // 2
+			fuzzy = {}
+			for n, count in shared.items():
+				if count >= need:
+					fuzzy.setdefault(search_fuzzy * count // len(grams), []).append(n)
+			found.extend(fuzzy.items())
+		scores = {}
+		for score, ns in sorted(found, key=lambda hit: hit[0]):
+			scores.update(dict.fromkeys(ns, score))
+		return scores
+
+	def query(self, text, limit=20): # -> [(score, app record)], best first; every word has to match
+		import heapq
+		terms = search_words(text)
+		if not terms:
+			return []
+		perTerm = sorted((self.termScores(term) for term in terms), key=len) # intersect starting with the rarest word
+		total = perTerm[0]
+		for scores in perTerm[1:]:
+			total = {n: score + scores[n] for n, score in total.items() if n in scores}
+		prefix = " ".join(terms)
+		apps = self.apps
+		ranked = heapq.nsmallest(limit, [(-score - search_name_bonus if apps[n][7].startswith(prefix) else -score, n) for n, score in total.items()])
+		return [(-score, apps[n]) for score, n in ranked]
+
+def run_query(text, path, limit, config): # print the best matches from the index at path, built first if it is missing
+	index = SearchIndex.load(path)
+	stats.lap("load-index")
+	if index is None: # no index yet: one scan, and the file is there for the next query
+		menu = MenuBuilder(config).build()
+		MenuTarget("index", path, config.show_icons, False).write(menu)
+		index = SearchIndex.fromMenu(menu, config.show_icons)
+		stats.lap("index")
+	hits = index.query(text, limit)
+	stats.lap("query")
+	# id, name, command, icon per line; the icon column is empty without icons
+	sys.stdout.write("".join(f"{app[0]}\t{app[1]}\t{app[4]}\t{app[5]}\n" for score, app in hits))
+	return 0
+
+# write_menu() outcomes, also the exit status of a run with file outputs
+MENU_WRITTEN = 0
+MENU_FAILED = 1
+MENU_UNCHANGED = 3 # every output file already had this content: no write, no reconfigure
+
+def file_digest(path): # sha256 of an existing file, None when it cannot be read
+	import hashlib
+	try:
+		with open(path, "rb") as fh:
+			return hashlib.sha256(fh.read()).digest()
+	except OSError:
+		return None
+
+def replace_file(path, data): # temp file + rename, so labwc never reads a half-written menu
+	path = os.path.realpath(path) # a symlinked menu.xml stays a symlink
+	tmp = os.path.join(os.path.dirname(path), ".%s.%d.tmp" % (os.path.basename(path), os.getpid()))
+	try:
+		with open(tmp, "wb") as fh:
+			fh.write(data)
+			fh.flush()
+			os.fsync(fh.fileno())
+		os.replace(tmp, path)
+	except OSError:
+		try:
+			os.unlink(tmp)
+		except OSError:
+			pass
+		raise
+
+class MenuTarget(object):
+	# One output of a run. All targets render from the same Menu, so extra variants only cost
+	# emission; the builder resolves icons and the footer if any target shows them.
+	formats = ("static", "pipe", "json", "index")
+
+	def __init__(self, fmt, path="-", icons=True, footer=True):
+		self.fmt = fmt
+		self.path = path # "-" is stdout
+		self.icons = icons
+		self.footer = footer
+
+	@classmethod
+	def parse(cls, spec, icons=True, footer=True): # "FORMAT[,OPTION...][=PATH]", options default to -n / -f
+		head, sep, path = spec.partition("=")
+		fmt, *options = head.split(",")
+		if fmt not in cls.formats:
+			raise ValueError(f"unknown format {fmt!r} in {spec!r} (use {', '.join(cls.formats)})")
+		for option in options:
+			if option in ("icons", "no-icons"):
+				icons = option == "icons"
+			elif option in ("footer", "no-footer"):
+				footer = option == "footer"
+			else:
+				raise ValueError(f"unknown option {option!r} in {spec!r}")
+		if fmt == "index" and (not sep or path in ("", "-")):
+			raise ValueError(f"the search index is binary and needs a file: {spec!r}")
+		return cls(fmt, os.path.expanduser(path) if sep and path else "-", icons, footer)
+
+	def toFile(self):
+		return self.path != "-"
+
+	def render(self, menu):
+		if self.fmt == "json":
+			return render_json(menu, self.icons)
+		if self.fmt == "index":
+			return SearchIndex.fromMenu(menu, self.icons).dump()
+		return render_menu(menu, self.fmt, self.icons, self.footer)
+
+	def write(self, menu): # -> MENU_*
+		data = self.render(menu)
+		if not self.toFile():
+			sys.stdout.write(data)
+			return MENU_WRITTEN
+		import hashlib
+		if isinstance(data, str):
+			data = data.encode()
+		if hashlib.sha256(data).digest() == file_digest(self.path):
+			print(f"{self.path} unchanged, skipping write.", file=sys.stderr)
+			return MENU_UNCHANGED
+		try:
+			if self.fmt == "index": # the default one lives in cache_dir, which may not exist yet
+				os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			replace_file(self.path, data)
+		except OSError as e:
+			print(f"Error writing output file: {e}", file=sys.stderr)
+			return MENU_FAILED
+		return MENU_WRITTEN
+
+def reconfigure_labwc():
+	# Only run this if we generated a static file (otherwise it's an infinite loop in a pipe menu)
+	import subprocess
+	print("Attempting to reconfigure labwc...", file=sys.stderr)
+	try:
+		subprocess.run(["labwc", "--reconfigure"], check=False)
+		print("labwc reconfigured successfully.", file=sys.stderr)
+	except FileNotFoundError:
+		print("Warning: 'labwc' command not found. Skipping reconfigure.", file=sys.stderr)
+	except Exception as e:
+		print(f"Error reconfiguring labwc: {e}", file=sys.stderr)
+
+def write_menu(menu, targets): # write every target, then reconfigure labwc once if a static menu file changed -> MENU_*
+	results = [target.write(menu) for target in targets]
+	stats.lap("emit")
+	# --- AUTO RECONFIGURE LABWC ---
+	if any(r == MENU_WRITTEN and t.fmt == "static" and t.toFile() for t, r in zip(targets, results)):
+		reconfigure_labwc()
+		stats.lap("reconfigure")
+	if MENU_FAILED in results:
+		return MENU_FAILED
+	return MENU_WRITTEN if MENU_WRITTEN in results else MENU_UNCHANGED
+
+# --- Watch mode ---
+# Keeps the parsed entries in memory and regenerates the static menu when inotify reports
+# changes in the application sources or the icon theme roots. Bursts (a package manager dropping
+# hundreds of files) are debounced into one regeneration, and only the .desktop files named
+# in the events are parsed again.
+watch_debounce = 2.0   # seconds of quiet before regenerating
+watch_max_delay = 30.0 # regenerate anyway if events keep coming for this long
+
+class Inotify(object):
+	# minimal ctypes binding so watch mode needs no extra packages
+	IN_MODIFY = 0x2
+	IN_ATTRIB = 0x4
+	IN_CLOSE_WRITE = 0x8
+	IN_MOVED_FROM = 0x40
+	IN_MOVED_TO = 0x80
+	IN_CREATE = 0x100
+	IN_DELETE = 0x200
+	IN_DELETE_SELF = 0x400
+	IN_MOVE_SELF = 0x800
+	IN_Q_OVERFLOW = 0x4000
+	IN_ONLYDIR = 0x01000000
+	DIR_CHANGES = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+	def __init__(self):
+		import ctypes, ctypes.util
+		self.ctypes = ctypes
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		self.watches = {}
+
+	def add(self, path, mask=DIR_CHANGES):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			return None
+		self.watches[wd] = path
+		return wd
+
+	def read(self): # -> [(watched dir, mask, name)]
+		import struct
+		events = []
+		try:
+			buf = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return events
+		i = 0
+		while i + 16 <= len(buf):
+			wd, mask, cookie, length = struct.unpack_from("iIII", buf, i)
+			name = buf[i + 16:i + 16 + length].rstrip(b"\0")
+			i += 16 + length
+			events.append((self.watches.get(wd, ""), mask, os.fsdecode(name)))
+		return events
+
+def watch_roots(builder): # (application dirs, icon roots, parents of missing application dirs, config dirs) that currently exist
+	cfg = builder.config
+	appDirs = list(builder.scannedDirs) # including subdirectories such as kde4/
+	iconRoots = [d for d in cfg.icon_dirs if os.path.isdir(d)]
+	iconRoots += [d + "/" + t for d in cfg.icon_dirs for t in builder.resolver.chain if os.path.isdir(d + "/" + t)]
+	parents = [os.path.dirname(d) for d in builder.sourceRoots() if not os.path.isdir(d) and os.path.isdir(os.path.dirname(d))]
+	configDirs = list(dict.fromkeys(os.path.dirname(f) for f in cfg.ignore_files + cfg.category_files if os.path.isdir(os.path.dirname(f))))
+	return appDirs, iconRoots, parents, configDirs
+
+def wait_for_changes(notifier):
+	import select
+	events = []
+	select.select([notifier.fd], [], [])
+	first = time.monotonic()
+	while True:
+		events += notifier.read()
+		left = watch_max_delay - (time.monotonic() - first)
+		if left <= 0 or not select.select([notifier.fd], [], [], min(watch_debounce, left))[0]:
+			return events
+
+def watch_menu(builder, publish): # publish(menu) is called once at start and after every change
+	notifier = Inotify()
+	publish(builder.build())
+	if stats_modes:
+		stats.report(stats_modes)
+	while True:
+		appDirs, iconRoots, parents, configDirs = watch_roots(builder)
+		ignoreNames = [os.path.basename(f) for f in builder.config.ignore_files]
+		categoryNames = [os.path.basename(f) for f in builder.config.category_files]
+		for d in appDirs + iconRoots + parents + configDirs:
+			notifier.add(d) # re-adding an existing watch is a no-op
+		changed = set()
+		icons = False
+		rescan = False
+		for path, mask, name in wait_for_changes(notifier):
+			if mask & Inotify.IN_Q_OVERFLOW: # lost events, start over
+				builder.entries.clear()
+				icons = True
+			elif path in appDirs:
+				if name.endswith(".desktop") or path + "/" + name in builder.sourceOf:
+					changed.add(path + "/" + name)
+				else: # a subdirectory (or an executable for a source) came or went
+					rescan = True
+			elif path in iconRoots:
+				icons = True
+			elif path in parents: # a missing applications dir may have appeared
+				rescan = True
+			if path in configDirs and name in ignoreNames: # menu-ignore.conf edited
+				builder.dropIgnoreRules()
+				rescan = True
+			if path in configDirs and name in categoryNames: # menu-categories.conf edited
+				builder.dropCategories()
+				rescan = True
+		if changed or icons or rescan:
+			stats.lap("idle") # time spent waiting for events is not part of the run
+			stats.reset()
+			if icons or builder.config.show_icons: # an app's icons land below theme dirs that are not watched,
+				builder.reload_icons()              # so the theme stamps are checked again and misses forgotten
+			publish(builder.build(changed))
+			if stats_modes:
+				stats.report(stats_modes)
+
+# --- Pipe menu daemon ---
+# `--daemon` keeps the model in memory (refreshed by the watch loop above) and serves the
+# rendered <openbox_pipe_menu> on a Unix socket; menu-client.py just copies it to stdout,
+# so opening the menu costs neither the scan nor this module's startup.
+def socket_path(config):
+	return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or config.cache_dir, "labwc-menu.sock")
+
+def render_pipe_menu(menu):
+	return render_menu(menu, "pipe").encode()
+
+class MenuServer(object):
+	def __init__(self, path):
+		import socket
+		self.path = path
+		self.response = b""
+		self.ready = threading.Event() # clients that connect during the first scan wait for it
+		if os.path.exists(path):
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				probe.connect(path)
+				raise OSError(f"another menu daemon is already listening on {path}")
+			except (ConnectionRefusedError, FileNotFoundError):
+				os.unlink(path) # stale socket from a crashed daemon
+			finally:
+				probe.close()
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.bind(path)
+		os.chmod(path, 0o600)
+		self.sock.listen(16)
+
+	def publish(self, menu):
+		self.response = render_pipe_menu(menu)
+		self.ready.set()
+
+	def serve_forever(self):
+		while True:
+			conn, addr = self.sock.accept()
+			with conn:
+				self.ready.wait()
+				try:
+					conn.sendall(self.response)
+				except OSError: # client went away
+					pass
+
+	def close(self):
+		self.sock.close()
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+def run_daemon(builder):
+	import signal
+	try:
+		server = MenuServer(socket_path(builder.config))
+	except OSError as e:
+		print(f"Error starting menu daemon: {e}", file=sys.stderr)
+		return False
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # so systemd stop removes the socket
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	try:
+		watch_menu(builder, server.publish)
+	finally:
+		server.close()
+	return True
+
+# --- Lazy pipe menu (--lazy / --category) ---
+# The root pipe menu only lists the categories, each as a nested pipe menu running --category, plus
+# the footer. A build stores the model as small marshal files in cache_dir/menu-model: "root" with
+# the categories, the footer and a stamp of the scanned directories and ignore files, and one
+# "cat-<name>" file per category with its (label, icon, command) items. --lazy rebuilds only when
+# the stamp of the builder's inputs is stale; --category reads just its own file, so opening a submenu costs what that
+# category holds, not what is installed.
+class LazyModel(object):
+	version = 1
+
+	def __init__(self, config):
+		self.dir = config.cache_dir + "/menu-model"
+		self.key = (self.version, config.show_icons, config.render_size) # what the stored items depend on
+		self.showFooter = config.show_footer
+
+	def categoryFile(self, name):
+		return self.dir + "/cat-" + name.replace("/", "_")
+
+	def load(self, path):
+		import marshal
+		try:
+			with open(path, "rb") as fh:
+				data = marshal.loads(fh.read())
+		except Exception:
+			return None
+		if not isinstance(data, tuple) or data[0] != self.key:
+			return None
+		return data[1:]
+
+	def loadRoot(self): # -> (categories, footer) or None when missing, built differently or stale
+		data = self.load(self.dir + "/root")
+		if data is None:
+			return None
+		stamp, hasFooter, categories, footer = data
+		if (self.showFooter and not hasFooter) or not stampIsCurrent(stamp):
+			return None
+		return categories, footer
+
+	def loadCategory(self, name): # -> [(label, icon, command)] or None
+		data = self.load(self.categoryFile(name))
+		return data[0] if data is not None else None
+
+	def save(self, menu, builder): # -> (categories, footer) as stored
+		import marshal
+		cfg = builder.config
+		stamp = {path: mtimeOf(path) for path in builder.inputs()} # a missing dir or file is stamped 0 and noticed when it appears
+		categories = [(groupName, groupIcon) for groupName, groupIcon, catList in menu.categories]
+		names = set()
+		for groupName, groupIcon, catList in menu.categories:
+			items = [(app.Name, app.Icon, launch_command(app)) for app in catList]
+			names.add(os.path.basename(self.categoryFile(groupName)))
+			writeCacheBytes(self.categoryFile(groupName), marshal.dumps((self.key, items), 2), "menu model")
+		try:
+			for name in os.listdir(self.dir): # categories that are empty now
+				if name.startswith("cat-") and name not in names:
+					os.unlink(self.dir + "/" + name)
+		except OSError:
+			pass
+		# the root goes last, so a reader never sees categories that have no file yet
+		writeCacheBytes(self.dir + "/root", marshal.dumps((self.key, stamp, cfg.show_footer, categories, menu.footer), 2), "menu model")
+		return categories, menu.footer
+
+def run_lazy(builder, category, execute): # print the root (category None) or one category as a pipe menu
+	cfg = builder.config
+	model = LazyModel(cfg)
+	emitter = MenuEmitter(menu_formats["pipe"], cfg.show_icons, cfg.show_footer)
+	if category is None:
+		root = model.loadRoot()
+		stats.lap("load-model")
+		if root is None:
+			root = model.save(builder.build(), builder)
+			stats.lap("save-model")
+		sys.stdout.write(emitter.renderRoot(root[0], root[1], execute))
 	else:
-		sysMenuStr = '<menu id="session-menu" label="Session"'
-		if sessionIcon:
-			sysMenuStr += f' icon="{sessionIcon}"'
-		sysMenuStr += '>'
-		print(sysMenuStr)
-		for item in session_items:
-			write_item(item, "")
-		print('</menu>')
+		items = model.loadCategory(category)
+		stats.lap("load-model")
+		if items is None: # no model yet (or built with other options): build it once
+			menu = builder.build()
+			model.save(menu, builder)
+			items = [(app.Name, app.Icon, launch_command(app)) for groupName, groupIcon, catList in menu.categories if groupName == category for app in catList]
+			stats.lap("save-model")
+		sys.stdout.write(emitter.renderItems(items))
+	stats.lap("emit")
+	return 0
 
+# --- Staleness probe (--check) ---
+# A run with --check first compares the manifest the last run with the same command line left in
+# cache_dir against the mtimes it recorded: MenuBuilder.inputs() (applications dirs, ignore files,
+# PATH dirs and with icons the GTK settings files, icon dirs and theme roots), the output files
+# and this script. When none changed it exits MENU_UNCHANGED before argparse, the theme or any
+# cache is loaded. Adding, removing or renaming a .desktop file changes its directory; a file
+# edited in place is picked up by the next run that generates anyway (or by the watch service).
+class Manifest(object):
+	version = 1
 
-if __name__ == "__main__":
+	def __init__(self, argv):
+		import zlib
+		self.key = (self.version, [a for a in argv if a != "--check"], application_sources, applications_dirs, image_dir_base, cache_dir, os.environ.get("XDG_CURRENT_DESKTOP", ""), os.environ.get("PATH", ""))
+		self.id = "%08x" % zlib.crc32(repr(self.key).encode()) # also names this command line's RunLock files
+		self.path = cache_dir + "/check-" + self.id
+
+	def isCurrent(self):
+		import marshal
+		try:
+			with open(self.path, "rb") as fh:
+				key, stamp = marshal.loads(fh.read())
+		except Exception:
+			return False
+		return key == self.key and stampIsCurrent(stamp)
+
+	def save(self, builder, targets):
+		import marshal
+		paths = builder.inputs() + [t.path for t in targets if t.toFile()] + [os.path.abspath(__file__)]
+		stamp = {path: mtimeOf(path) for path in paths}
+		writeCacheBytes(self.path, marshal.dumps((self.key, stamp), 2), "check manifest")
+
+# --- Run coalescing ---
+# Menu files are written by one generation at a time: the timer, the "Update Menu" footer item,
+# menu-generator.sh and the watch service all flock() cache_dir/generate.lock. A one-shot run
+# that finds the lock taken leaves a pending-<id> file for its command line and waits. The running
+# generation repeats itself for as long as the pending file for its own command line keeps coming
+# back, so any number of identical requests during a run cost one rerun; a waiter whose pending
+# file was consumed returns the status that rerun left in result-<id> instead of generating again.
+# Requests with other options just queue on the lock.
+class RunLock(object):
+	def __init__(self, name):
+		self.lockFile = cache_dir + "/generate.lock"
+		self.pending = cache_dir + "/pending-" + name
+		self.result = cache_dir + "/result-" + name
+		self.fd = None
+
+	def acquire(self, block=True): # -> False when block is False and another process holds the lock
+		import fcntl
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			self.fd = os.open(self.lockFile, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+		except OSError as e: # like the caches, an unusable cache dir must not cost the menu
+			print(f"Warning: could not open the generation lock, running unlocked: {e}", file=sys.stderr)
+			return True
+		try:
+			fcntl.flock(self.fd, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+			return True
+		except BlockingIOError:
+			os.close(self.fd)
+			self.fd = None
+			return False
+
+	def release(self):
+		if self.fd is not None:
+			os.close(self.fd) # drops the flock
+		self.fd = None
+
+	@contextlib.contextmanager
+	def exclusive(self): # plain mutual exclusion, for the watch service's writes
+		self.acquire()
+		try:
+			yield
+		finally:
+			self.release()
+
+	def lastResult(self): # status the last generation for this command line recorded, None if unknown
+		try:
+			with open(self.result) as fh:
+				return int(fh.read())
+		except (OSError, ValueError):
+			return None
+
+	def run(self, generate): # -> status of a generate() that started after this call
+		if not self.acquire(False):
+			with open(self.pending, "a"):
+				pass
+			print("Another menu generation is running, waiting for it...", file=sys.stderr)
+			self.acquire()
+			status = self.lastResult()
+			if not os.path.exists(self.pending) and status is not None: # that run repeated itself for this request
+				self.release()
+				stats.count("runs_coalesced")
+				return status
+		if self.fd is None: # running unlocked, nobody to coalesce with
+			return generate()
+		wrote = False
+		try:
+			while True:
+				with contextlib.suppress(FileNotFoundError):
+					os.unlink(self.pending)
+				status = generate()
+				wrote = wrote or status == MENU_WRITTEN
+				if wrote and status == MENU_UNCHANGED: # a rerun found the menu an earlier pass already wrote
+					status = MENU_WRITTEN
+				writeCacheBytes(self.result, b"%d" % status, "run result") # what coalesced waiters return
+				if not os.path.exists(self.pending):
+					return status
+				print("Menu generation requested again meanwhile, running once more.", file=sys.stderr)
+				stats.count("runs_repeated")
+		finally:
+			self.release()
+
+def main(argv=None):
+	global stats_modes
+	argv = sys.argv[1:] if argv is None else list(argv)
+	if "--check" in argv and Manifest(argv).isCurrent():
+		print("Menu inputs unchanged since the last run, nothing to do.", file=sys.stderr)
+		return MENU_UNCHANGED
+	import argparse
 	parser = argparse.ArgumentParser(
-		description="Generate Openbox/Labwc menus.\nTo Edit the footer open the code and edit footer_items according to you",
+		description="Generate Openbox/Labwc menus.\nTo Edit the footer open the code and edit the footer_*_items lists according to you",
         formatter_class=argparse.RawTextHelpFormatter
 	)
-	parser.add_argument("-o", "--output", help="Path to output file for static menu generation.")
+	parser.add_argument("-o", "--output", help="Path to output file for static menu generation.\nExits with 3 (and skips labwc --reconfigure) when the\nfile already has the generated content.")
+	parser.add_argument("-t", "--target", action="append", default=[], metavar="SPEC", help="Additional output, repeatable; all outputs share one scan.\nSPEC is FORMAT[,OPTION...][=PATH]: FORMAT static, pipe or\njson (app model), OPTION icons, no-icons, footer or\nno-footer (defaults follow -n/-f), PATH - for stdout.\ne.g. -t static,no-icons=menu.xml -t json=apps.json")
+	parser.add_argument("--index", nargs="?", const="", default=None, metavar="PATH", help="Also write the search index for --query (default PATH:\n$XDG_CACHE_HOME/labwc-menu/search.index)")
+	parser.add_argument("-q", "--query", metavar="TEXT", help="Print the apps matching TEXT, best first, as tab separated\nid, name, command and icon; reads the --index file and\nscans only when it does not exist yet")
+	parser.add_argument("--limit", type=int, default=20, help="Most --query results. Default: %(default)s")
+	parser.add_argument("-l", "--lazy", action="store_true", help="Print a root pipe menu with the categories as nested pipe\nmenus (--category) and the footer, from the cached model")
+	parser.add_argument("-c", "--category", metavar="NAME", help="Print the pipe menu of one category from the cached model")
+	parser.add_argument("--check", action="store_true", help="Exit with 3 right away when nothing the last run with the\nsame options read (applications and icon dirs, GTK settings,\nPATH, outputs) changed since; otherwise generate as usual")
 	parser.add_argument("-f", "--footer", default="true", help="Show custom footer (true/false). Default: true")
 	parser.add_argument("-n", "--no-icons", action="store_true", help="Disable icons in menu")
-	args = parser.parse_args()
+	parser.add_argument("--render-icons", action="store_true", help="Point the menu at PNGs pre-rendered to the menu icon size\n(%d px) in the cache instead of the theme files" % menu_icon_size)
+	parser.add_argument("--icon-scale", type=int, default=1, metavar="N", help="Render --render-icons at N times the size, for HiDPI\noutputs. Default: %(default)s")
+	parser.add_argument("-j", "--jobs", type=int, default=default_jobs(), help="Parse desktop files with N worker threads (1 = serial).\nDefault: %(default)s")
+	parser.add_argument("-w", "--watch", action="store_true", help="Stay resident and regenerate the -o/--target files whenever\napplications or icon themes change (inotify)")
+	parser.add_argument("-d", "--daemon", action="store_true", help="Stay resident and serve the pipe menu on a Unix socket\n(read it with menu-client.py)")
+	parser.add_argument("--stats", nargs="?", const="text", default=None, metavar="MODES", help="Report per-phase timings and counters. MODES is a comma\nseparated list of text (stderr, default), json (stderr)\nand journal (one line via logger). Also: LABWC_MENU_STATS")
+	args = parser.parse_args(argv)
+	if args.stats is not None:
+		stats_modes = args.stats
+	if args.daemon and (args.watch or args.output or args.target or args.index is not None):
+		parser.error("--daemon serves the pipe menu and cannot be combined with --watch, -o, --target or --index")
+	if args.query is not None and (args.watch or args.daemon or args.output or args.target):
+		parser.error("--query only reads the search index and cannot be combined with --watch, --daemon, -o or --target")
+	if args.check and (args.watch or args.daemon or args.query is not None or args.lazy or args.category is not None):
+		parser.error("--check is for one-shot runs with -o, --target or --index")
+	if (args.lazy or args.category is not None) and (args.watch or args.daemon or args.output or args.target or args.index is not None or args.query is not None):
+		parser.error("--lazy and --category print pipe menus and cannot be combined with other outputs or modes")
+	indexPath = os.path.expanduser(args.index) if args.index else cache_dir + "/search.index"
 
 	# Logic to convert string argument to boolean
 	show_footer = str(args.footer).lower() in ("true", "1", "yes", "on", "t")
 	show_icons = not args.no_icons
-
-	application_groups=sorted(application_groups, key=str.lower)
-	for appGroup in application_groups:
-		categoryDict[appGroup] = []
-	
-	dtFiles=[]
-	for appDir in applications_dirs:
-		appDir += "/*.desktop"
-		dtFiles+=glob.glob(appDir)
-	
-	for dtf in dtFiles:
-		skipFlag = False
-		for ifn in ignoreList:
-			if dtf.find(ifn) >= 0:
-				skipFlag = True
-		if skipFlag == False:
-			process_dtfile(dtf,  categoryDict)
-
-	output_handle = sys.stdout
-	if args.output:
-		try:
-			output_handle = open(args.output, 'w')
-		except IOError as e:
-			print(f"Error opening output file: {e}", file=sys.stderr)
-			sys.exit(1)
-	
-	if args.output:
-		output_handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-		output_handle.write('<openbox_menu >\n')
-		output_handle.write('    <menu id="root-menu" label="Applications">\n')
+	if args.query is not None:
+		stats.lap("startup")
+		status = run_query(args.query, indexPath, args.limit, MenuConfig(showIcons=show_icons, showFooter=False, jobs=args.jobs))
+		if stats_modes:
+			stats.report(stats_modes)
+		return status
+	targets = [MenuTarget("static", args.output, show_icons, show_footer)] if args.output else []
+	if args.index is not None:
+		targets.append(MenuTarget("index", indexPath, show_icons, False))
+	try:
+		targets += [MenuTarget.parse(spec, show_icons, show_footer) for spec in args.target]
+	except ValueError as e:
+		parser.error(str(e))
+	if not targets:
+		targets = [MenuTarget("pipe", "-", show_icons, show_footer)]
+	if args.watch and not all(t.toFile() for t in targets):
+		parser.error("--watch needs -o/--output or --target outputs that are files")
+	if args.check and not all(t.toFile() for t in targets): # an unchanged run would print nothing
+		parser.error("--check needs -o/--output, --target or --index outputs that are files")
+	if args.daemon:
+		show_icons = targets[0].icons
+		show_footer = targets[0].footer
 	else:
-		print ("<openbox_pipe_menu>") # this is enough
+		show_icons = any(t.icons for t in targets)
+		show_footer = any(t.footer and t.fmt in ("static", "pipe") for t in targets)
+	renderSize = menu_icon_size * max(1, args.icon_scale) if args.render_icons else 0
+	if args.lazy or args.category is not None:
+		import shlex
+		builder = MenuBuilder(MenuConfig(showIcons=show_icons, showFooter=show_footer, jobs=args.jobs, renderSize=renderSize))
+		stats.lap("startup")
+		# the submenus read the model with the same options that built it
+		command = [sys.executable, os.path.abspath(__file__)] + (["-n"] if not show_icons else []) + (["--render-icons", "--icon-scale", str(args.icon_scale)] if renderSize else [])
+		status = run_lazy(builder, args.category, lambda name: shlex.join(command + ["--category", name]))
+		if stats_modes:
+			stats.report(stats_modes)
+		return status
+	builder = MenuBuilder(MenuConfig(showIcons=show_icons, showFooter=show_footer, jobs=args.jobs, renderSize=renderSize))
+	stats.lap("startup")
 
-	appGroupLen = len(application_groups)
-	
-	for ag in range(appGroupLen):
-		catList = categoryDict[application_groups[ag]]
-		if len(catList) < 1:
-			continue 
-		
-		tmpList=[] 
-		for app in catList: 
-			app.Name= ' '.join([word[0].upper()+word[1:] for word in app.Name.split(' ')]) 
-			tmpList.append([app.Name, [app.Icon, app.Terminal, app.Exec]]) 
-		catList=sorted(tmpList, key = lambda x: x[0].lower()) 
-		
-		groupName = application_groups[ag]
-		groupIcon = getCatIcon(groupName)
-		
-		if args.output:
-			menu_line = f'        <menu id="{groupName}" label="{groupName}"'
-			if groupIcon and show_icons:
-				menu_line += f' icon="{groupIcon}"'
-			menu_line += ">"
-			output_handle.write(menu_line + "\n")
+	if args.watch or args.daemon:
+		try:
+			if args.daemon:
+				return 0 if run_daemon(builder) else 1
+			runLock = RunLock("watch")
+			def publish(menu):
+				with runLock.exclusive():
+					write_menu(menu, targets)
+			watch_menu(builder, publish)
+		except KeyboardInterrupt:
+			pass
+		return 0
 
-			for app in catList:
-				appName = xescape(app[0])
-				appIcon = app[1][0]
-				isTerm = app[1][1]
-				appExec = app[1][2]
-				
-				cmdString = appExec
-				if isTerm:
-					cmdString = f"{terminal_string} {appExec}"
-				cmdString = xescape(cmdString)
-
-				item_line = f'            <item label="{appName}"'
-				if appIcon and show_icons:
-					item_line += f' icon="{appIcon}"'
-				item_line += ">"
-				output_handle.write(item_line + "\n")
-				output_handle.write('                <action name="Execute">\n')
-				output_handle.write(f'                    <command>{cmdString}</command>\n')
-				output_handle.write('                </action>\n')
-				output_handle.write('            </item>\n')
-
-			output_handle.write(f'        </menu> <!-- {groupName} -->\n')
+	manifest = Manifest(argv)
+	def generate():
+		status = write_menu(builder.build(), targets)
+		if args.check and status != MENU_FAILED:
+			manifest.save(builder, targets)
+		return status
+	if any(t.toFile() for t in targets):
+		status = RunLock(manifest.id).run(generate)
+	else: # a pipe menu on stdout writes nothing another run could race on
+		status = generate()
+	if stats_modes and status != MENU_FAILED:
+		stats.report(stats_modes)
+	return status
 
-		else:
-			catStr = "<menu id=\"openbox-%s\" label=\"%s\" " % (groupName, groupName)
-			if groupIcon != "" and show_icons:
-				catStr += "icon=\"%s\"" % groupIcon
-			print (catStr + ">")
-			for app in catList:
-				progStr = "<item "
-				progStr += "label=\"%s\" " % app[0] 
-				if app[1][0] != "" and show_icons: 
-					progStr += "icon=\"%s\" " % app[1][0] 
-				progStr += "><action name=\"Execute\"><command><![CDATA["
-				if app[1][1] == True:  
-					progStr += terminal_string + " "
-				progStr += "%s]]></command></action></item>"  % app[1][2] 
-				print (progStr)
-			print ("</menu>")
-
-	# --- PRINT CUSTOM FOOTER ---
-	if show_footer:
-		print_custom_footer(output_handle, args.output, show_icons)
-
-	# WRITE FOOTERS
-	if args.output:
-		output_handle.write('    </menu>\n')
-		output_handle.write('</openbox_menu>\n')
-	else:
-		print ("</openbox_pipe_menu>") 
-		
-	if args.output and output_handle != sys.stdout:
-		output_handle.close()
-	
-	if args.output:
-		# --- AUTO RECONFIGURE LABWC ---
-		# Only run this if we generated a static file (otherwise it's an infinite loop in a pipe menu)
-		print("Attempting to reconfigure labwc...", file=sys.stderr)
-		try:
-			subprocess.run(["labwc", "--reconfigure"], check=False)
-			print("labwc reconfigured successfully.", file=sys.stderr)
-		except FileNotFoundError:
-			print("Warning: 'labwc' command not found. Skipping reconfigure.", file=sys.stderr)
-		except Exception as e:
-			print(f"Error reconfiguring labwc: {e}", file=sys.stderr)
\ No newline at end of file
+if __name__ == "__main__":
+	sys.exit(main())
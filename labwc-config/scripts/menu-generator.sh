@@ -14,13 +14,22 @@ case "$main_choice" in
     "Yes")
         python3 "$menu_generator" -o "$menu_file"
         # Notify user about menu generated sometimes it take few seccods to generate menu.
-        notify-send "SUCCESS" "Desktop menu generated with Footer"
+        # (exit status 3: menu.xml already had this content)
+        case $? in
+            0) notify-send "SUCCESS" "Desktop menu generated with Footer" ;;
+            3) notify-send "SUCCESS" "Desktop menu already up to date" ;;
+            *) notify-send "ERROR" "Desktop menu generation failed" ;;
+        esac
         ;;
 
     "No")
         python3 "$menu_generator" -f false -o "$menu_file"
         # Notify user about menu generated
-        notify-send "SUCCESS" "Desktop menu generated without Footer"
+        case $? in
+            0) notify-send "SUCCESS" "Desktop menu generated without Footer" ;;
+            3) notify-send "SUCCESS" "Desktop menu already up to date" ;;
+            *) notify-send "ERROR" "Desktop menu generation failed" ;;
+        esac
         ;;
     *)
         exit 0
@@ -15,21 +15,26 @@ if [ ! -f "$MENU_GENERATOR" ]; then
 fi
 
 # Generate menu without icons (cleaner look)
-if python3 "$MENU_GENERATOR" --no-icons -o "$MENU_FILE"; then
+# The generator reconfigures labwc itself when menu.xml changed; exit 3 means it was already current
+# (--index refreshes the search index that menu-generator.py --query reads from the same scan).
+# The timer passes --check, which exits with 3 before scanning anything when no application, icon
+# or PATH directory changed; it only stats directories, so manual runs (the menu's "Update Menu")
+# leave it out and also catch .desktop files edited in place.
+CHECK=()
+if [ "$1" = "--check" ]; then
+    CHECK=(--check)
+fi
+python3 "$MENU_GENERATOR" "${CHECK[@]}" --no-icons -o "$MENU_FILE" --index
+status=$?
+if [ $status -eq 0 ]; then
     echo "Menu updated successfully"
     
-    # Reload labwc configuration
-    if command -v labwcctl >/dev/null 2>&1; then
-        labwcctl reload
-        echo "Labwc reloaded"
-    else
-        echo "Restart Labwc to see menu changes"
-    fi
-    
     # Log to systemd journal
     if command -v logger >/dev/null 2>&1; then
         logger -t labwc-menu "Application menu updated successfully"
     fi
+elif [ $status -eq 3 ]; then
+    echo "Menu already up to date"
 else
     echo "Error: Failed to generate menu"
     exit 1